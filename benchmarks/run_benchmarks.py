@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the render pipeline.
+
+Each case renders a synthetic video (or Spin) in a fresh process with the Agg
+backend, and records the frames per second, the time spent in each stage per
+frame, and the peak RSS. The results are written as JSON so they can be
+compared across commits. No network, GPU or ffmpeg is needed; with --encode,
+the frames are also encoded with ffmpeg to measure the writer.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--encode] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import multiprocessing
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import video_creator as vc
+from video_creator.profiling import RenderProfiler, peak_rss, STAGES
+
+RNG_SEED = 0
+
+'''
+###############################################################################
+### Synthetic scenes. Each builder returns a list of Scenes lasting sduration.
+###############################################################################
+'''
+
+def line_scenes(sduration):
+    x = np.linspace(0,10,10000)
+    def draw(t,fig,timing=vc.Timing()):
+        ax = fig.add_subplot(111)
+        ax.plot(x,np.sin(x-t),color='k')
+        ax.plot(t,np.sin(t),'o',color='r')
+        ax.set_xlim(0,10)
+        ax.set_ylim(-1.5,1.5)
+        ax.set_title('t = '+'{:.3f}'.format(t))
+    return [vc.Scene(draw,vc.LinearPlaybackDefinedDuration(0,10,sduration))]
+
+def line_update_scenes(sduration):
+    x = np.linspace(0,10,10000)
+    def setup(fig,timing=vc.Timing()):
+        ax = fig.add_subplot(111)
+        ax.set_xlim(0,10)
+        ax.set_ylim(-1.5,1.5)
+        line, = ax.plot([],[],color='k')
+        return line
+    def update(t,line,timing=vc.Timing()):
+        line.set_data(x,np.sin(x-t))
+    return [vc.UpdateScene(setup,update,vc.LinearPlaybackDefinedDuration(0,10,sduration))]
+
+def imshow_scenes(sduration,static_background=False):
+    img = np.random.RandomState(RNG_SEED).rand(2000,2000)
+    def setup(fig,timing=vc.Timing()):
+        ax = fig.add_subplot(111)
+        ax.imshow(img,extent=[0,10,-1.5,1.5],aspect='auto')
+        point, = ax.plot([],[],'o',color='r')
+        return point
+    def update(t,point,timing=vc.Timing()):
+        point.set_data([t],[np.sin(t)])
+    return [vc.UpdateScene(setup,update,vc.LinearPlaybackDefinedDuration(0,10,sduration),
+                           static_background=static_background)]
+
+def imshow_static_scenes(sduration):
+    return imshow_scenes(sduration,static_background=True)
+
+def scatter_scenes(sduration):
+    rs = np.random.RandomState(RNG_SEED)
+    xy = rs.randn(100000,2)
+    v = rs.randn(100000,2)
+    def setup(fig,timing=vc.Timing()):
+        ax = fig.add_subplot(111)
+        ax.set_xlim(-5,5)
+        ax.set_ylim(-5,5)
+        return ax.scatter(xy[:,0],xy[:,1],s=1)
+    def update(t,points,timing=vc.Timing()):
+        points.set_offsets(xy+0.1*t*v)
+    return [vc.UpdateScene(setup,update,vc.LinearPlaybackDefinedDuration(0,10,sduration))]
+
+def text_scenes(sduration):
+    words = ['lorem','ipsum','dolor','sit','amet','consectetur','adipiscing','elit']
+    def draw(t,fig,timing=vc.Timing()):
+        ax = fig.add_axes([0,0,1,1])
+        ax.set_axis_off()
+        for i in range(40):
+            ax.text((i%5)/5.,(i//5)/8.,' '.join(words[(i+j)%len(words)] for j in range(3)),fontsize=10)
+        ax.text(0.5,0.5,'TITLE TEXT '+'{:.2f}'.format(t),ha='center',va='center',fontsize=30)
+    return [vc.Scene(draw,vc.LinearPlaybackDefinedDuration(0,1,sduration))]
+
+SCENES = {'line':line_scenes,
+          'line_update':line_update_scenes,
+          'imshow':imshow_scenes,
+          'imshow_static':imshow_static_scenes,
+          'scatter_1e5':scatter_scenes,
+          'text':text_scenes}
+
+'''
+###############################################################################
+### Running the cases.
+###############################################################################
+'''
+
+def _new_figure(figsize,dpi):
+    fig = Figure(figsize=figsize,dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+def _run_video_case(case):
+    '''Render a synthetic Video and return its metrics.
+    '''
+    fig = _new_figure(case['figsize'],case['dpi'])
+    scenes = SCENES[case['scenes']](case['n_frames']/case['fps'])
+    video = vc.Video(scenes,fig,fps=case['fps'])
+    profiler = RenderProfiler()
+
+    start = time.perf_counter()
+    if case['encode']:
+        with tempfile.TemporaryDirectory() as d:
+            video.write_video(os.path.join(d,'video.mp4'),hooks=[profiler])
+    else:
+        for fi,(frame,frame_stats) in enumerate(video._iter_frames()):
+            frame_stats.update(video._frame_info(fi))
+            profiler(frame_stats)
+    elapsed = time.perf_counter()-start
+    return _metrics(profiler,elapsed)
+
+def _run_spin_case(case):
+    '''Render a synthetic 3D Spin and return its metrics.
+    '''
+    fig = _new_figure(case['figsize'],case['dpi'])
+    ax = fig.add_subplot(111,projection='3d')
+    u,v = np.meshgrid(np.linspace(0,2*np.pi,80),np.linspace(0,np.pi,40))
+    ax.plot_surface(np.cos(u)*np.sin(v),np.sin(u)*np.sin(v),np.cos(v),cmap='viridis')
+    ax.scatter(*np.random.RandomState(RNG_SEED).randn(3,2000)*0.5,s=2)
+    spin = vc.Spin(fig,ax,period=case['n_frames']/case['fps'])
+    profiler = RenderProfiler()
+
+    start = time.perf_counter()
+    if case['encode']:
+        with tempfile.TemporaryDirectory() as d:
+            spin.write_video(os.path.join(d,'video.mp4'),fps=case['fps'],hooks=[profiler])
+    else:
+        for frame,frame_stats in spin._iter_frames(case['fps']):
+            frame_stats['peak_rss'] = peak_rss()
+            profiler(frame_stats)
+    elapsed = time.perf_counter()-start
+    return _metrics(profiler,elapsed)
+
+def _metrics(profiler,elapsed):
+    '''Summarize the profiler of a case.
+    '''
+    n = len(profiler.frames)
+    metrics = {'n_frames_rendered':n,
+               'elapsed':elapsed,
+               'fps':n/elapsed if elapsed > 0 else None,
+               'peak_rss':peak_rss()}
+    for stage in STAGES:
+        times = np.array([f[stage] for f in profiler.frames])
+        metrics[stage] = {'mean':float(times.mean()),
+                          'p50':float(np.percentile(times,50)),
+                          'p95':float(np.percentile(times,95)),
+                          'max':float(times.max())}
+    return metrics
+
+def run_case(case):
+    '''Run one case; meant to be called in a fresh process so the peak RSS
+    belongs to the case alone.
+    '''
+    if case['scenes'] == 'spin':
+        metrics = _run_spin_case(case)
+    else:
+        metrics = _run_video_case(case)
+    return {'case':case,'metrics':metrics}
+
+def build_cases(quick=False,encode=False):
+    '''The grid of cases: each set of scenes at several figure sizes, dpi
+    values and frame counts.
+    '''
+    if quick:
+        figsizes,dpis,frame_counts = [(6,4)],[72],[10]
+    else:
+        figsizes,dpis,frame_counts = [(6,4),(12,8)],[72,150],[30,120]
+    cases = []
+    for scenes in list(SCENES)+['spin']:
+        for figsize in figsizes:
+            for dpi in dpis:
+                for n_frames in frame_counts:
+                    cases.append({'scenes':scenes,'figsize':figsize,'dpi':dpi,
+                                  'n_frames':n_frames,'fps':30,'encode':encode})
+    return cases
+
+def _environment():
+    '''Describe the commit and environment the benchmarks ran in.
+    '''
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit':commit,
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'matplotlib':matplotlib.__version__,
+            'platform':platform.platform(),
+            'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick',action='store_true',help='run a small grid of cases')
+    parser.add_argument('--encode',action='store_true',help='also encode the frames with ffmpeg')
+    parser.add_argument('--scenes',nargs='*',default=None,help='only run these sets of scenes')
+    parser.add_argument('--output',default='bench_output.json',help='path of the JSON results')
+    args = parser.parse_args(argv)
+
+    cases = build_cases(quick=args.quick,encode=args.encode)
+    if args.scenes:
+        cases = [c for c in cases if c['scenes'] in args.scenes]
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for case in cases:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_case,(case,))
+        m = result['metrics']
+        print('{:14s} {:>8s} dpi {:4d} {:5d} frames: {:7.1f} fps, peak RSS {:6.0f} MB'.format(
+            case['scenes'],'x'.join(str(x) for x in case['figsize']),case['dpi'],case['n_frames'],
+            m['fps'],(m['peak_rss'] or 0)/2**20))
+        results.append(result)
+
+    with open(args.output,'w') as f:
+        json.dump({'environment':_environment(),'results':results},f,indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,5 @@ setup(name='videos-with-matplotlib',
       install_requires=[
           'matplotlib',
           'numpy',
-          'scipy',
           ],
       )
\ No newline at end of file
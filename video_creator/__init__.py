@@ -7,6 +7,13 @@ Created on Thu Aug 22 18:03:09 2019
 
 from .timing import *
 from .fader import *
-from .scene import Scene
-from .video import Video
-from .spin import Spin
\ No newline at end of file
+from .scene import Scene, UpdateScene
+from .video import Video, FrameRenderError
+from .spin import Spin, SpinScene
+from .transitions import Transition, Crossfade, Wipe
+from .cache import FrameCache
+from .sinks import VideoSink, ImageSink
+from .parallel import RenderPool
+from .jobs import RenderJob, RenderCancelled
+from .profiling import ProgressPrinter, RenderProfiler
+from .datasource import TimeSeries
\ No newline at end of file
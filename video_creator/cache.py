@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of rendered frames, so frames of Scenes which haven't changed
+since a previous run don't have to be drawn again.
+
+Each frame is stored under a key made from the identity of its Scene, the
+frame's scene time, index time and playback rate, and the size and dpi of the
+figure. A Scene's identity is a hash of its drawing functions (their code,
+closures, default arguments and the module-level data they use), its Timing
+parameters and its other settings. Data which a drawing function reaches only
+indirectly, such as through an attribute of an object it doesn't reference by
+name, or files it reads, isn't part of the hash; call FrameCache.clear after
+changing it.
+
+MemoryFrameCache instead keeps recently requested frames of a single Video in
+memory, by frame index, for Video.frame and Video.frames.
+"""
+
+import os
+import types
+import collections
+import pickle
+import hashlib
+import numpy as np
+
+def _hash_value(h,obj,seen):
+    '''Feed a stable representation of obj into the hash h.
+    '''
+
+    # simple values
+    if obj is None or isinstance(obj,(bool,int,float,complex,str,bytes)):
+        h.update(repr(obj).encode())
+        return
+    if isinstance(obj,np.ndarray):
+        h.update(str((obj.dtype,obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+        return
+    if isinstance(obj,types.ModuleType):
+        h.update(('module:'+obj.__name__).encode())
+        return
+    if isinstance(obj,type):
+        h.update(('class:'+obj.__module__+'.'+obj.__qualname__).encode())
+        return
+
+    # guard against cycles, keeping a reference to each object so that its id
+    # isn't reused by a temporary object
+    if id(obj) in seen:
+        h.update(b'<seen>')
+        return
+    seen[id(obj)] = obj
+
+    if isinstance(obj,(list,tuple)):
+        h.update(('%s:%d' % (type(obj).__name__,len(obj))).encode())
+        for o in obj:
+            _hash_value(h,o,seen)
+    elif isinstance(obj,dict):
+        h.update(('dict:%d' % len(obj)).encode())
+        for k in sorted(obj,key=repr):
+            _hash_value(h,k,seen)
+            _hash_value(h,obj[k],seen)
+    elif isinstance(obj,types.MethodType):
+        _hash_value(h,obj.__func__,seen)
+        _hash_value(h,obj.__self__,seen)
+    elif isinstance(obj,types.FunctionType):
+        _hash_function(h,obj,seen)
+    elif isinstance(obj,types.CodeType):
+        _hash_code(h,obj,seen)
+    elif type(obj).__module__.split('.')[0] == 'video_creator':
+        # Timings, faders, etc: hash what defines them, not their frame state
+        h.update(('object:'+type(obj).__qualname__).encode())
+        _hash_value(h,_public_state(obj),seen)
+    else:
+        try:
+            h.update(pickle.dumps(obj,protocol=4))
+        except Exception:
+            if hasattr(obj,'__dict__'):
+                h.update(('object:'+type(obj).__qualname__).encode())
+                _hash_value(h,_public_state(obj),seen)
+            else:
+                # unstable between runs, so it's just a cache miss
+                h.update(repr(obj).encode())
+
+def _public_state(obj):
+    '''The attributes of an object which define it, skipping the ones holding
+    the state of the current frame and private caches.
+    '''
+    return {k:v for k,v in vars(obj).items() if not k.startswith('_') and not k.startswith('current_') and k != 'artists'}
+
+def _hash_code(h,code,seen):
+    '''Hash a code object, including any nested code objects in its constants.
+    '''
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        _hash_value(h,const,seen)
+
+def _hash_function(h,func,seen):
+    '''Hash a function's code, closure, defaults, and the globals it uses.
+    '''
+    _hash_code(h,func.__code__,seen)
+    _hash_value(h,func.__defaults__,seen)
+    _hash_value(h,func.__kwdefaults__,seen)
+    if func.__closure__ is not None:
+        for cell in func.__closure__:
+            try:
+                _hash_value(h,cell.cell_contents,seen)
+            except ValueError:
+                # empty cell
+                h.update(b'<empty>')
+    for name in _global_names(func.__code__):
+        if name in func.__globals__:
+            h.update(name.encode())
+            _hash_value(h,func.__globals__[name],seen)
+
+def _global_names(code):
+    '''All the names a code object (and the code nested in it) may look up.
+    '''
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const,types.CodeType):
+            names |= _global_names(const)
+    return sorted(names)
+
+def scene_fingerprint(scene):
+    '''
+    Return a hex digest identifying what a Scene draws: its class, drawing
+    functions, Timing parameters and settings.
+    '''
+    h = hashlib.sha1()
+    h.update(type(scene).__qualname__.encode())
+    _hash_value(h,_public_state(scene),{})
+    return h.hexdigest()
+
+class FrameCache:
+    '''
+    Cache of rendered frames in a directory, evicting the least recently used
+    frames once their total size exceeds max_bytes.
+
+    Parameters
+    ----------
+    directory : str.
+        The directory in which the frames are stored. Created if needed.
+
+    max_bytes : int.
+        The maximum total size of the cached frames, in bytes.
+    '''
+
+    def __init__(self,directory,max_bytes=2**33):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory,exist_ok=True)
+        self.total_bytes = sum(e.stat().st_size for e in self._entries())
+
+    def _entries(self):
+        '''The files of all the cached frames.
+        '''
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                for e in os.scandir(sub.path):
+                    if e.name.endswith('.npy'):
+                        yield e
+
+    def _path(self,key):
+        return os.path.join(self.directory,key[:2],key+'.npy')
+
+    def frame_key(self,fingerprint,stime,indextime,playback_rate,fig):
+        '''
+        Return the key for a frame of the Scene with the given fingerprint
+        (see scene_fingerprint), drawn on the Figure fig.
+        '''
+        h = hashlib.sha1(fingerprint.encode())
+        h.update(repr((float(stime),float(indextime),float(playback_rate),
+                       tuple(float(x) for x in fig.get_size_inches()),float(fig.dpi))).encode())
+        return h.hexdigest()
+
+    def __contains__(self,key):
+        return os.path.exists(self._path(key))
+
+    def touch(self,key):
+        '''
+        Mark a frame as recently used, so frames stored after this don't
+        evict it first. Return whether the frame is cached.
+        '''
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            return False
+        return True
+
+    def get(self,key):
+        '''
+        Return the cached RGBA array for a key, or None if it isn't cached.
+        '''
+        path = self._path(key)
+        try:
+            frame = np.load(path)
+        except (OSError,ValueError):
+            return None
+
+        # mark the frame as recently used
+        os.utime(path)
+        return frame
+
+    def put(self,key,frame):
+        '''
+        Store a frame under a key, evicting old frames if needed.
+        '''
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+
+        # write to a temporary file first so a crash can't leave a partial frame
+        tmp_path = path+'.tmp'
+        with open(tmp_path,'wb') as f:
+            np.save(f,frame)
+        # a frame stored again replaces the old file
+        if os.path.exists(path):
+            self.total_bytes -= os.path.getsize(path)
+        os.replace(tmp_path,path)
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        '''Remove the least recently used frames until the cache is back
+        under 90% of max_bytes.
+        '''
+        entries = sorted(((e.stat().st_mtime,e.stat().st_size,e.path) for e in self._entries()))
+        self.total_bytes = sum(size for _,size,_ in entries)
+        for _,size,path in entries:
+            if self.total_bytes <= 0.9*self.max_bytes:
+                break
+            os.remove(path)
+            self.total_bytes -= size
+
+    def clear(self):
+        '''
+        Remove all the cached frames.
+        '''
+        for e in list(self._entries()):
+            os.remove(e.path)
+        self.total_bytes = 0
+
+class MemoryFrameCache:
+    '''
+    Cache of rendered frames in memory, keyed by frame index, evicting the
+    least recently used frames once their total size exceeds max_bytes. The
+    frames are stored read-only, since the same arrays are handed out on
+    every hit.
+
+    Parameters
+    ----------
+    max_bytes : int.
+        The maximum total size of the cached frames, in bytes.
+    '''
+
+    def __init__(self,max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._frames = collections.OrderedDict()
+
+    def __contains__(self,key):
+        return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self,key):
+        '''
+        Return the cached RGBA array for a key, or None if it isn't cached.
+        '''
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self,key,frame):
+        '''
+        Store a frame under a key, evicting old frames if needed. Frames
+        larger than max_bytes aren't stored.
+        '''
+        if frame.nbytes > self.max_bytes:
+            return
+        if key in self._frames:
+            self.total_bytes -= self._frames.pop(key).nbytes
+        frame.setflags(write=False)
+        self._frames[key] = frame
+        self.total_bytes += frame.nbytes
+        while self.total_bytes > self.max_bytes:
+            _,old_frame = self._frames.popitem(last=False)
+            self.total_bytes -= old_frame.nbytes
+
+    def clear(self):
+        '''
+        Remove all the cached frames.
+        '''
+        self._frames.clear()
+        self.total_bytes = 0
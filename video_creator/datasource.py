@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Fast lookup of data by index time, for use in the functions drawing a Scene.
+
+Scanning the whole dataset for the sample nearest the index time of each
+frame, as with np.argmin(np.abs(t-times)), costs O(N) per frame. TimeSeries
+wraps sorted sample times instead, and finds samples with a binary search in
+O(log N). Since the frames of a video usually move forward through index
+time, it also keeps a block of samples around the last lookup in memory, so
+consecutive lookups are served from that block; this matters when the data
+are memory-mapped from disk.
+"""
+
+import numpy as np
+
+class TimeSeries:
+    '''
+    Samples recorded at sorted index times.
+
+    Parameters
+    ----------
+    times : array-like.
+        The index times of the samples, sorted in increasing order. Can be a
+        np.memmap.
+
+    values : array-like.
+        The samples, with the first axis matching times. Can be a np.memmap.
+
+    block_size : int.
+        The number of samples kept in memory around the last lookup.
+
+    Methods
+    ----------
+    nearest_index : the index of the sample nearest an index time
+    nearest : the sample nearest an index time
+    at : the sample at an index time, interpolated between neighbours
+    window : the samples within a range of index times before an index time
+    from_npy : load times and values from .npy files as memory maps
+    '''
+
+    def __init__(self,times,values,block_size=4096):
+        if len(times) != len(values):
+            raise ValueError('times and values must have the same length')
+        if len(times) == 0:
+            raise ValueError('times and values must not be empty')
+        self.times = times
+        self.values = values
+        self.block_size = block_size
+        self._block_start = 0
+        self._block_times = np.asarray(times[:block_size])
+        self._block_values = np.asarray(values[:block_size])
+
+    @classmethod
+    def from_npy(cls,fpath_times,fpath_values,**kwargs):
+        '''
+        Create a TimeSeries from .npy files of the times and values, memory
+        mapped so only the samples looked up are read from disk.
+        '''
+        return cls(np.load(fpath_times,mmap_mode='r'),np.load(fpath_values,mmap_mode='r'),**kwargs)
+
+    def __len__(self):
+        return len(self.times)
+
+    def _searchsorted(self,t):
+        '''Return the index of the first sample at or after t, looking in the
+        block in memory first and loading a new block starting just before t
+        if t is outside it.
+        '''
+        block_times = self._block_times
+        block_end = self._block_start+len(block_times)
+        if block_times[0] <= t and (t <= block_times[-1] or block_end == len(self.times)):
+            return self._block_start+int(np.searchsorted(block_times,t))
+
+        # search the whole series, then prefetch the samples following t
+        i = int(np.searchsorted(self.times,t))
+        self._block_start = max(i-1,0)
+        self._block_times = np.asarray(self.times[self._block_start:self._block_start+self.block_size])
+        self._block_values = np.asarray(self.values[self._block_start:self._block_start+self.block_size])
+        return i
+
+    def _sample(self,i):
+        '''Return sample i, from the block in memory if it's there.
+        '''
+        bi = i-self._block_start
+        if 0 <= bi < len(self._block_values):
+            return self._block_values[bi]
+        return np.asarray(self.values[i])
+
+    def _time(self,i):
+        '''Return the time of sample i, from the block in memory if it's there.
+        '''
+        bi = i-self._block_start
+        if 0 <= bi < len(self._block_times):
+            return self._block_times[bi]
+        return self.times[i]
+
+    def nearest_index(self,t):
+        '''
+        Return the index of the sample nearest the index time t.
+        '''
+        i = self._searchsorted(t)
+        if i == 0:
+            return 0
+        if i == len(self.times):
+            return i-1
+        return i if self._time(i)-t < t-self._time(i-1) else i-1
+
+    def nearest(self,t):
+        '''
+        Return the sample nearest the index time t.
+        '''
+        return self._sample(self.nearest_index(t))
+
+    def at(self,t):
+        '''
+        Return the sample at the index time t, linearly interpolated between
+        the samples on either side of it. Outside the range of the samples,
+        the first or last sample is returned.
+        '''
+        i = self._searchsorted(t)
+        if i == 0:
+            return self._sample(0)
+        if i == len(self.times):
+            return self._sample(i-1)
+        t0,t1 = self._time(i-1),self._time(i)
+        frac = (t-t0)/(t1-t0)
+        return (1-frac)*self._sample(i-1)+frac*self._sample(i)
+
+    def window(self,t,duration,include_end=True):
+        '''
+        Return the times and values of the samples in the trailing window
+        between the index times t-duration and t.
+
+        Returns
+        ----------
+        times, values : np.ndarray
+            Views of the samples in the window, which are read from disk only
+            when accessed if the data are memory mapped.
+        '''
+        i0 = int(np.searchsorted(self.times,t-duration,side='left'))
+        i1 = int(np.searchsorted(self.times,t,side='right' if include_end else 'left'))
+        return self.times[i0:i1],self.values[i0:i1]
@@ -5,114 +5,130 @@ Created on Mon Nov 11 14:52:46 2019
 @author: Daniel Ruth
 """
 
+import weakref
 import numpy as np
 
-#class TimeScaler:
-    
-    
+def _ramp(x,x_start,x_end):
+    '''Return 0 before x_start, 1 from x_end on, and rise linearly between.
+    '''
+    x = np.asarray(x,dtype=float)
+    if x_end == x_start:
+        return (x>=x_start).astype(float)[()]
+    return np.clip((x-x_start)/(x_end-x_start),0,1)[()]
+
+class TimeScaler:
+    '''
+    Base class of the faders, which give a value rising from 0 to 1 over the
+    course of a fade.
+
+    Calling a fader with a Timing gives the value at the Timing's current
+    scene time, as in a draw function. Where the fade is defined in scene
+    time, the scene times at which it starts and ends are found once for each
+    Timing, with timing.time_to_stime; .bind(timing) does this ahead of time,
+    so each later call is only a bit of arithmetic. The fader holds no other
+    state, so the same instance can be used with several Timings and in
+    parallel renders. .values(timing,stime) evaluates the fade at an array of
+    scene times at once, e.g. every frame of a Scene.
+    '''
+
+    def __init__(self):
+        self._bounds = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # the bounds are tied to the Timing instances, so are found again
+        # for the copies of the Timings made along with the fader
+        state = self.__dict__.copy()
+        del state['_bounds']
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._bounds = weakref.WeakKeyDictionary()
+
+    def _compute_bounds(self,timing):
+        '''Return the scene times at which the fade starts and ends.
+        '''
+        raise NotImplementedError
+
+    def bind(self,timing):
+        '''
+        Find the scene times at which the fade starts and ends with timing,
+        ahead of the first frame drawn. Returns the fader.
+        '''
+        if timing not in self._bounds:
+            self._bounds[timing] = self._compute_bounds(timing)
+        return self
+
+    def stime_bounds(self,timing):
+        '''
+        Return the scene times at which the fade starts and ends with timing.
+        '''
+        self.bind(timing)
+        return self._bounds[timing]
+
+    def _values(self,timing,stime,indextime):
+        '''Return the values at the given scene times and index times.
+        '''
+        start_scenetime,end_scenetime = self.stime_bounds(timing)
+        return _ramp(stime,start_scenetime,end_scenetime)
+
+    def values(self,timing,stime):
+        '''
+        Return the values of the fade at one or an array of scene times.
+        '''
+        return self._values(timing,stime,timing(stime))
 
-class TimeScalerIxAndIx:
+    def __call__(self,timing):
+        return float(self._values(timing,timing.current_stime,timing.current_indextime))
+
+class TimeScalerIxAndIx(TimeScaler):
     '''
     Fader given the start and end indextimes of the fade.
     '''
-    
+
     def __init__(self,start_indextime,end_indextime,use_log=False):
+        super().__init__()
         self.start_indextime = start_indextime
         self.end_indextime = end_indextime
         self.use_log = use_log
-        
-    def __call__(self,timing):
-        indextime = timing.current_indextime
-        
-        # if it's after the fade has started
-        if indextime >= self.start_indextime:
-            
-            # if it's during the fade, calculate the value
-            if indextime < self.end_indextime:
-                if self.use_log:
-                    val = (np.log(self.end_indextime)-np.log(indextime)) / (np.log(self.end_indextime)-np.log(self.start_indextime))
-                else:
-                    val = (indextime-self.start_indextime) / (self.end_indextime-self.start_indextime)
-                    
-            # if it's after the fade ends, return 1
-            else:
-                val = 1
-         
-        # if it's befor the fade, return 0
-        else:
-            val = 0
-            
-        return val
-        
-class TimeScalerStartIxAndDuration:
+
+    def _compute_bounds(self,timing):
+        return timing.time_to_stime(self.start_indextime),timing.time_to_stime(self.end_indextime)
+
+    def _values(self,timing,stime,indextime):
+        # the fade follows the index time, so needs no bounds in scene time
+        if self.use_log:
+            # index times at or below zero are before the fade
+            indextime = np.asarray(indextime,dtype=float)
+            with np.errstate(divide='ignore',invalid='ignore'):
+                values = _ramp(np.log(indextime),np.log(self.start_indextime),np.log(self.end_indextime))
+            return np.where(indextime > 0,values,0.)[()]
+        return _ramp(indextime,self.start_indextime,self.end_indextime)
+
+class TimeScalerStartIxAndDuration(TimeScaler):
     '''
-    Fader given a start indextime and sceneduration. Trickier since the 
-    scenetime corresponding to the start_indextime is not known until it 
-    occurs.
+    Fader given a start indextime and sceneduration. The scenetime
+    corresponding to the start_indextime is found from the timing.
     '''
     def __init__(self,start_indextime,duration_scenetime):
+        super().__init__()
         self.start_indextime = start_indextime
         self.duration_scenetime = duration_scenetime
-        self.start_scenetime = np.nan
-        self.end_scenetime = np.nan
-    
-    def __call__(self,timing):
-        stime = timing.current_stime
-        
-        # now that we have a timing object, calculate the start and end scenetimes
-        if np.isnan(self.start_scenetime):
-            self.start_scenetime = timing.time_to_stime(self.start_indextime)
-            self.end_scenetime = self.start_scenetime+self.duration_scenetime
-        
-        # if it's after the fade has started
-        if stime >= self.start_scenetime:
-            
-            # if it's during the fade, calculate the value
-            if stime < self.end_scenetime:
-                val = (stime-self.start_scenetime) / self.duration_scenetime
-            
-            # if it's after the fade ends, return 1
-            else:
-                val = 1
-         
-        # if it's befor the fade, return 0
-        else:
-            val = 0
-            
-        return val
-    
-class TimeScalerDurationAndEndIx:
+
+    def _compute_bounds(self,timing):
+        start_scenetime = float(timing.time_to_stime(self.start_indextime))
+        return start_scenetime,start_scenetime+self.duration_scenetime
+
+class TimeScalerDurationAndEndIx(TimeScaler):
     '''
     Fader given a scene duration and ending index time.
     '''
-    
+
     def __init__(self,duration_scenetime,end_indextime):
+        super().__init__()
         self.duration_scenetime = duration_scenetime
         self.end_indextime = end_indextime
-        self.start_scenetime = np.nan
-        self.end_scenetime = np.nan
-        
-    def __call__(self,timing):
-        stime = timing.current_stime
-        
-        # now that we have a timing object, calculate the start and end scenetimes
-        if np.isnan(self.start_scenetime):
-            self.end_scenetime = timing.time_to_stime(self.end_indextime)
-            self.start_scenetime = self.end_scenetime - self.duration_scenetime
-            
-        # if it's after the fade has started
-        if stime >= self.start_scenetime:
-            
-            # if it's during the fade, calculate the value
-            if stime < self.end_scenetime:
-                val = (self.end_scenetime-stime) / self.sduration
-            
-            # if it's after the fade ends, return 1
-            else:
-                val = 1
-         
-        # if it's befor the fade, return 0
-        else:
-            val = 0
-            
-        return val
\ No newline at end of file
+
+    def _compute_bounds(self,timing):
+        end_scenetime = float(timing.time_to_stime(self.end_indextime))
+        return end_scenetime-self.duration_scenetime,end_scenetime
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Animated GIF and WebP writers which need no external tools.
+
+GIF frames are limited to a palette of 256 colors. The palette is built from
+a sample of the frames by popularity: the RGB colors are counted in a
+histogram with 5 bits per channel, and the most common bins become the
+palette colors (the mean color of the pixels in each bin). Each frame is then
+quantized by looking up the nearest palette color of every pixel in a table
+over 6 bits per channel, optionally with ordered (Bayer) dithering, all in
+NumPy. Only the rectangle which changed since the previous frame is encoded,
+and frames identical to the previous one lengthen its display time instead
+of being written. The alpha channel is ignored.
+
+Animated WebP frames keep their full colors, and libwebp encodes only the
+changes between frames itself; the frames are held in memory until the file
+is written, so this suits short loops.
+"""
+
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+def _bayer_matrix(n):
+    '''Return the n x n Bayer matrix (n a power of 2) as thresholds between
+    -0.5 and 0.5.
+    '''
+    m = np.zeros((1,1),dtype=int)
+    while len(m) < n:
+        m = np.block([[4*m,4*m+2],[4*m+3,4*m+1]])
+    return (m+0.5)/m.size-0.5
+
+def _bin_index(rgb,bits):
+    '''Return the index of the histogram bin, with bits bits per channel, of
+    each of an array of RGB colors.
+    '''
+    q = (rgb >> (8-bits)).astype(np.int32)
+    return (q[...,0] << 2*bits) | (q[...,1] << bits) | q[...,2]
+
+def sample_indices(n_frames,n_samples):
+    '''
+    Return up to n_samples frame indices spread evenly over n_frames frames,
+    to build a palette from.
+    '''
+    return np.unique(np.linspace(0,n_frames-1,n_samples).round().astype(int))
+
+def build_palette(frames,n_colors=256,bits=5):
+    '''
+    Build a palette of up to n_colors colors from the most common colors of
+    some frames, counted in a histogram with bits bits per channel.
+
+    Parameters
+    ----------
+    frames : iterable of np.ndarray.
+        (height,width,3 or 4) uint8 frames.
+
+    Returns
+    ----------
+    palette : np.ndarray
+        The (n,3) uint8 palette colors, most common first.
+    '''
+    n_bins = 1 << (3*bits)
+    counts = np.zeros(n_bins)
+    sums = np.zeros((n_bins,3))
+    for frame in frames:
+        rgb = frame[...,:3].reshape(-1,3)
+        bins = _bin_index(rgb,bits)
+        counts += np.bincount(bins,minlength=n_bins)
+        for c in range(3):
+            sums[:,c] += np.bincount(bins,weights=rgb[:,c],minlength=n_bins)
+    top = np.argsort(counts,kind='stable')[::-1][:n_colors]
+    top = top[counts[top] > 0]
+    return (sums[top]/counts[top,None]).round().astype(np.uint8)
+
+class PaletteQuantizer:
+    '''
+    Map frames to the indices of the nearest colors of a palette.
+
+    Parameters
+    ----------
+    palette : np.ndarray.
+        The (n,3) uint8 palette colors, with n at most 256.
+
+    dither : bool.
+        Whether to add ordered (Bayer) dithering, which breaks up banding in
+        gradients. Pixels which already have a palette color aren't
+        dithered.
+
+    bits : int.
+        The bits per channel of the lookup table of nearest colors.
+    '''
+
+    def __init__(self,palette,dither=False,bits=6):
+        self.palette = palette
+        self.dither = dither
+        self.bits = bits
+
+        # the nearest palette color to the center of each bin of the table,
+        # in chunks to bound the memory of the distances
+        n_bins = 1 << (3*bits)
+        levels = ((np.arange(1 << bits) << (8-bits))+(1 << (8-bits))/2.).astype(np.float32)
+        pal = palette.astype(np.float32)
+        pal_sq = (pal**2).sum(axis=1)
+        self.lut = np.empty(n_bins,dtype=np.uint8)
+        chunk = 1 << 14
+        for start in range(0,n_bins,chunk):
+            bins = np.arange(start,min(start+chunk,n_bins))
+            centers = np.stack([levels[bins >> 2*bits],levels[(bins >> bits) & ((1 << bits)-1)],
+                                levels[bins & ((1 << bits)-1)]],axis=1)
+            self.lut[bins] = np.argmin(pal_sq[None,:]-2*centers@pal.T,axis=1)
+
+        # spread the dithering over the typical distance between neighbouring
+        # palette colors
+        if len(palette) > 1:
+            distances = np.sqrt(np.maximum(pal_sq[:,None]+pal_sq[None,:]-2*pal@pal.T,0))
+            np.fill_diagonal(distances,np.inf)
+            self._dither_spread = float(np.median(distances.min(axis=1)))
+        else:
+            self._dither_spread = 0.
+
+    def quantize(self,frames):
+        '''
+        Return the palette indices of the pixels of one (height,width,3 or
+        4) frame, or of a batch of frames with any leading dimensions, as
+        uint8.
+        '''
+        rgb = frames[...,:3]
+        indices = self.lut[_bin_index(rgb,self.bits)]
+        if not self.dither:
+            return indices
+        height,width = rgb.shape[-3:-1]
+        thresholds = np.tile(_bayer_matrix(8),(height//8+1,width//8+1))[:height,:width]
+        dithered = np.clip(rgb+(self._dither_spread*thresholds)[...,None],0,255).astype(np.uint8)
+        # pixels already of a palette color, such as flat backgrounds, are
+        # left alone
+        exact = np.all(self.palette[indices] == rgb,axis=-1)
+        return np.where(exact,indices,self.lut[_bin_index(dithered,self.bits)])
+
+class GifWriter:
+    '''
+    Write palette-indexed frames to an animated GIF, one at a time.
+
+    Parameters
+    ----------
+    fpath : str.
+        The path of the GIF file.
+
+    fps : float.
+        The frames per second. GIF delays are whole hundredths of a second,
+        so frame times are rounded to them, and browsers slow down delays
+        under 0.02 s, so fps above 50 don't play back faithfully.
+
+    loop : int, or None.
+        The number of times to play the animation, 0 to loop forever, or
+        None to play it once.
+    '''
+
+    def __init__(self,fpath,fps,loop=0):
+        self.fpath = fpath
+        self.fps = fps
+        self.loop = loop
+        self._f = None
+        self._global_palette = None
+        self._prev_indices = None
+        self._prev_palette = None
+        self._pending = None
+        self._n_frames = 0
+
+    def _image(self,indices,palette):
+        '''Make a 'P' mode image of palette indices.
+        '''
+        im = Image.fromarray(np.ascontiguousarray(indices))
+        palette_bytes = np.zeros((256,3),dtype=np.uint8)
+        palette_bytes[:len(palette)] = palette
+        im.putpalette(palette_bytes.tobytes())
+        return im
+
+    def _frame_time(self,fi):
+        '''The time frame fi starts at, in hundredths of a second.
+        '''
+        return int(round(fi*100./self.fps))
+
+    def write(self,indices,palette):
+        '''
+        Write a frame given as a (height,width) uint8 array of indices into
+        palette, a (n,3) uint8 array of colors. Frames after the first with a
+        different palette are written with a local color table.
+        '''
+        fi = self._n_frames
+        self._n_frames += 1
+        if self._f is None:
+            self._f = open(self.fpath,'wb')
+            self._global_palette = palette
+            header,_ = GifImagePlugin.getheader(self._image(indices,palette),info={'loop':self.loop,'optimize':False})
+            for block in header:
+                self._f.write(block)
+
+        # only the rectangle which changed since the previous frame is written
+        offset = (0,0)
+        if self._prev_indices is not None and palette is self._prev_palette:
+            changed = indices != self._prev_indices
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows) == 0:
+                return
+            cols = np.flatnonzero(changed.any(axis=0))
+            offset = (int(cols[0]),int(rows[0]))
+            rect = indices[rows[0]:rows[-1]+1,cols[0]:cols[-1]+1]
+        else:
+            rect = indices
+        self._flush(fi)
+        self._pending = (self._image(rect,palette),offset,palette is not self._global_palette,fi)
+        self._prev_indices = indices
+        self._prev_palette = palette
+
+    def _flush(self,end_fi):
+        '''Write the pending frame, shown until frame end_fi starts.
+        '''
+        if self._pending is None:
+            return
+        im,offset,local_palette,start_fi = self._pending
+        delay = max(self._frame_time(end_fi)-self._frame_time(start_fi),1)
+        params = {'duration':10*delay,'disposal':1}
+        if local_palette:
+            params['include_color_table'] = True
+        for block in GifImagePlugin.getdata(im,offset=offset,**params):
+            self._f.write(block)
+        self._pending = None
+
+    def close(self):
+        '''
+        Write the last frame and finish the file.
+        '''
+        if self._f is None:
+            return
+        self._flush(self._n_frames)
+        self._f.write(b';')
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+class WebPWriter:
+    '''
+    Write RGBA frames to an animated WebP file. The frames are held in memory
+    until close, with consecutive identical frames merged.
+
+    Parameters
+    ----------
+    fpath : str.
+        The path of the WebP file.
+
+    fps : float.
+        The frames per second.
+
+    loop : int.
+        The number of times to play the animation, 0 to loop forever.
+
+    lossless : bool.
+        Whether to encode the frames losslessly.
+
+    quality : int.
+        The quality of lossy encoding, from 0 to 100.
+    '''
+
+    def __init__(self,fpath,fps,loop=0,lossless=False,quality=80):
+        self.fpath = fpath
+        self.fps = fps
+        self.loop = loop
+        self.lossless = lossless
+        self.quality = quality
+        self._images = []
+        self._start_frames = []
+        self._prev_frame = None
+        self._n_frames = 0
+
+    def write(self,frame):
+        '''
+        Add a (height,width,4) uint8 RGBA frame.
+        '''
+        fi = self._n_frames
+        self._n_frames += 1
+        if self._prev_frame is not None and np.array_equal(frame,self._prev_frame):
+            return
+        self._prev_frame = frame.copy()
+        self._images.append(Image.fromarray(self._prev_frame))
+        self._start_frames.append(fi)
+
+    def close(self):
+        '''
+        Encode the frames and write the file.
+        '''
+        if not self._images:
+            return
+        ends = self._start_frames[1:]+[self._n_frames]
+        durations = [int(round(1000.*end/self.fps))-int(round(1000.*start/self.fps))
+                     for start,end in zip(self._start_frames,ends)]
+        self._images[0].save(self.fpath,format='WEBP',save_all=True,append_images=self._images[1:],
+                             duration=durations,loop=self.loop,lossless=self.lossless,quality=self.quality)
+        self._images = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Writers saving frames given as RGBA arrays, either as image files compressed
+by a pool of threads while the next frames are drawn, or as a single
+memory-mapped .npy stack of shape (n_frames,height,width,4).
+"""
+
+import os
+import collections
+import concurrent.futures
+import numpy as np
+import matplotlib.image
+
+# image formats which can be written straight from the rendered pixels
+RASTER_EXTENSIONS = {'.png','.jpg','.jpeg','.tif','.tiff','.bmp','.webp'}
+
+# the formats to name for extensions which aren't format names themselves
+_IMAGE_FORMATS = {'.tif':'tiff'}
+
+def is_raster_extension(extension):
+    '''Whether images with the given extension can be written from pixels,
+    rather than by saving the Figure (as for vector formats like .pdf).
+    '''
+    return extension.lower() in RASTER_EXTENSIONS
+
+def image_format(fpath):
+    '''The format to pass to matplotlib.image.imsave for fpath, for
+    extensions which aren't the name of their format (as .tif), or None to
+    go by the extension.
+    '''
+    return _IMAGE_FORMATS.get(os.path.splitext(fpath)[1].lower())
+
+class ImageWriterPool:
+    '''
+    Save frames as image files from a pool of threads, so the compression of
+    each image (which releases the GIL) overlaps with drawing the next frames.
+
+    Parameters
+    ----------
+    n_threads : int.
+        The number of threads writing images.
+
+    dpi : float, or None.
+        The dpi to record in the image files' metadata.
+    '''
+
+    def __init__(self,n_threads=4,dpi=None):
+        self.n_threads = n_threads
+        self.dpi = dpi
+        self._executor = concurrent.futures.ThreadPoolExecutor(n_threads)
+        self._pending = collections.deque()
+
+    def save(self,fpath,frame):
+        '''
+        Save a (height,width,4) uint8 RGBA array to fpath. The array is
+        copied, so it can be overwritten once this returns. Blocks while
+        2*n_threads images are waiting to be written.
+        '''
+        while len(self._pending) >= 2*self.n_threads:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(matplotlib.image.imsave,fpath,frame.copy(),dpi=self.dpi,format=image_format(fpath)))
+
+    def close(self):
+        '''
+        Wait for every image to be written, raising any error hit.
+        '''
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is not None:
+            for future in self._pending:
+                future.cancel()
+        self.close()
+
+class FrameStackWriter:
+    '''
+    Write frames into a preallocated, memory-mapped .npy file of shape
+    (n_frames,height,width,4) and dtype uint8, which can be read with
+    np.load(fpath,mmap_mode='r'). The height and width are taken from the
+    first frame written.
+
+    Parameters
+    ----------
+    fpath : str.
+        The path of the .npy file.
+
+    n_frames : int.
+        The number of frames the stack holds.
+    '''
+
+    def __init__(self,fpath,n_frames):
+        self.fpath = fpath
+        self.n_frames = n_frames
+        self.stack = None
+        self._next_frame = 0
+
+    def write(self,frame):
+        '''
+        Copy a (height,width,4) uint8 RGBA array into the next slot of the
+        stack.
+        '''
+        if self.stack is None:
+            self.stack = np.lib.format.open_memmap(self.fpath,mode='w+',dtype=np.uint8,
+                                                   shape=(self.n_frames,)+frame.shape)
+        self.stack[self._next_frame] = frame
+        self._next_frame += 1
+
+    def close(self):
+        '''
+        Flush the stack to disk.
+        '''
+        if self.stack is not None:
+            self.stack.flush()
+            self.stack = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+        if exc_type is not None and os.path.exists(self.fpath):
+            os.remove(self.fpath)
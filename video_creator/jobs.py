@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Render jobs writing a Video in the background (see Video.submit).
+
+A job runs one of the Video's writing methods in a thread, counting the
+frames written with a hook. Cancelling a job makes that hook raise
+RenderCancelled after the current frame, which stops the writer (killing
+ffmpeg) and removes the partly written file. A job which fails removes its
+partly written file too.
+"""
+
+import os
+import asyncio
+import threading
+import concurrent.futures
+
+class RenderCancelled(Exception):
+    '''
+    Raised by the result of a RenderJob which was cancelled while running.
+    '''
+    pass
+
+class RenderJob:
+    '''
+    Handle on a Video being written in the background.
+
+    Attributes
+    ----------
+    n_frames : int.
+        The number of frames of the video.
+
+    n_frames_done : int.
+        The number of frames written so far.
+
+    future : concurrent.futures.Future.
+        The future of the job, whose result is the path written.
+
+    Methods
+    ----------
+    progress : the fraction of the frames written
+    cancel : stop the job
+    done : whether the job has finished
+    result : wait for the job and return the path written
+    '''
+
+    def __init__(self,video,fpath,method='write_video',executor=None,hooks=None,**kwargs):
+        self.video = video
+        self.fpath = fpath
+        self.method = method
+        self.n_frames = len(video.video_times)
+        self.n_frames_done = 0
+        self._hooks = [self._count_frame]+(list(hooks) if hooks is not None else [])
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+        if executor is None:
+            self.future = concurrent.futures.Future()
+            threading.Thread(target=self._run_into_future,daemon=True).start()
+        else:
+            self.future = executor.submit(self._run)
+
+    def _count_frame(self,frame_stats):
+        '''Hook counting the frames written, and stopping a cancelled job.
+        '''
+        self.n_frames_done += 1
+        if self._cancel_event.is_set():
+            raise RenderCancelled()
+
+    def _run(self):
+        '''Write the video, returning the path written.
+        '''
+        cancelled = False
+        try:
+            getattr(self.video,self.method)(self.fpath,hooks=self._hooks,**self._kwargs)
+        except RenderCancelled:
+            # handled once the traceback is released, so the frame iterators
+            # (and any frames queued in a RenderPool) are closed first
+            cancelled = True
+        except Exception:
+            self._remove_partial_file()
+            raise
+        if cancelled:
+            self._remove_partial_file()
+            raise RenderCancelled('Writing '+str(self.fpath)+' was cancelled after '
+                                  +str(self.n_frames_done)+' of '+str(self.n_frames)+' frames')
+        return self.fpath
+
+    def _remove_partial_file(self):
+        '''Remove the file of a job which didn't finish. Directories of
+        images are left as they are.
+        '''
+        if os.path.isfile(self.fpath):
+            os.remove(self.fpath)
+
+    def _run_into_future(self):
+        '''Run the job in its own thread, setting the result of the future.
+        '''
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            self.future.set_result(self._run())
+        except BaseException as e:
+            self.future.set_exception(e)
+
+    def progress(self):
+        '''
+        Return the fraction of the frames written so far.
+        '''
+        return self.n_frames_done/self.n_frames if self.n_frames else 1.
+
+    def cancel(self):
+        '''
+        Stop the job after the frame being written, or before it starts if
+        it's still waiting in an executor.
+        '''
+        self._cancel_event.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        '''
+        Whether the job was cancelled, before or while running.
+        '''
+        if self.future.cancelled():
+            return True
+        return self.future.done() and isinstance(self.future.exception(),RenderCancelled)
+
+    def done(self):
+        '''
+        Whether the job has finished, been cancelled or failed.
+        '''
+        return self.future.done()
+
+    def result(self,timeout=None):
+        '''
+        Wait for the job to finish and return the path written, or raise its
+        error (RenderCancelled if it was cancelled).
+        '''
+        return self.future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Render the frames of a Video across a pool of worker processes.
+
+Each worker rebuilds a Figure with the same size, dpi and facecolor as the
+Video's figure, draws its share of the frames on it, and sends back the
+pixels. With the default "fork" start method on Linux, the Scenes are
+inherited by the workers directly; with "spawn" (Windows, macOS) they have to
+be picklable, so each draw_fig_func must be defined at the top level of a
+module.
+"""
+
+import os
+import pickle
+import tempfile
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# the Video rebuilt in each worker process
+_worker_video = None
+
+def _video_spec(video):
+    '''What a worker needs to rebuild a Video on its own Figure.
+    '''
+    return (video.scenes,video.fig.get_size_inches(),video.fig.dpi,
+            video.fig.get_facecolor(),video.fps,video.transitions,video.video_times,video.max_rss)
+
+def _build_video(scenes,figsize,dpi,facecolor,fps,transitions,video_times,max_rss):
+    '''Build a Video on a new Figure, with the same frames as the Video in
+    the main process (which may not be the default ones, as for a preview).
+    '''
+    from .video import Video
+    fig = Figure(figsize=figsize,dpi=dpi,facecolor=facecolor)
+    FigureCanvasAgg(fig)
+    video = Video(scenes,fig,fps=fps,transitions=transitions,max_rss=max_rss)
+    video._set_video_times(video_times)
+    return video
+
+def _init_worker(*spec):
+    '''Build the worker's own Figure and Video.
+    '''
+    global _worker_video
+    _worker_video = _build_video(*spec)
+
+def _render_frames(frame_indices):
+    '''Render a chunk of frames in a worker, returning a list of RGBA arrays
+    and the stats of each frame.
+    '''
+    return _render_chunk(_worker_video,frame_indices)
+
+def _render_chunk(video,frame_indices):
+    '''Render a chunk of frames of a Video, returning a list of RGBA arrays
+    and the stats of each frame.
+    '''
+    frames = []
+    prev_frame = None
+    for frame,frame_stats in video._iter_drawn_frames(frame_indices):
+        # a repeated frame is sent as a second reference to the same array,
+        # which pickle only transfers once
+        if frame is prev_frame:
+            frames.append((frames[-1][0],frame_stats))
+        else:
+            frames.append((frame.copy(),frame_stats))
+        prev_frame = frame
+    return frames
+
+def iter_frames_parallel(video,frame_indices,workers,chunksize=4):
+    '''
+    Render frames of a Video in a process pool, yielding them in order.
+
+    Parameters
+    ----------
+    video : Video.
+        The video whose frames are rendered.
+
+    frame_indices : array-like of int.
+        The indices (into video.video_times) of the frames to render.
+
+    workers : int.
+        The number of worker processes.
+
+    chunksize : int.
+        The number of consecutive frames sent to a worker at once. Consecutive
+        frames usually belong to the same Scene, so larger chunks keep each
+        worker's state warm, at the cost of memory for the frames in flight.
+
+    Yields
+    ----------
+    frame : np.ndarray
+        The (height,width,4) uint8 RGBA array for each frame, in order.
+        
+    frame_stats : dict
+        The stats of the frame (see the profiling module).
+    '''
+    frame_indices = np.asarray(frame_indices)
+    chunks = [frame_indices[i:i+chunksize] for i in range(0,len(frame_indices),chunksize)]
+    with concurrent.futures.ProcessPoolExecutor(workers,initializer=_init_worker,initargs=_video_spec(video)) as executor:
+        for frame,frame_stats in _iter_results(executor,_render_frames,chunks,workers):
+            yield frame,frame_stats
+
+def _iter_results(executor,func,chunks,workers,*args):
+    '''Submit func(chunk,*args) for each chunk, and yield the items of the
+    results in order.
+    '''
+    # keep a bounded number of chunks in flight, so finished frames don't
+    # pile up in memory while the encoder catches up
+    pending = collections.deque()
+    chunks = iter(chunks)
+    for chunk in chunks:
+        pending.append(executor.submit(func,chunk,*args))
+        if len(pending) >= 2*workers:
+            break
+    while pending:
+        results = pending.popleft().result()
+        for chunk in chunks:
+            pending.append(executor.submit(func,chunk,*args))
+            break
+        for result in results:
+            yield result
+
+# the Spin copied into each worker process
+_worker_spin = None
+
+def _init_spin_worker(spin):
+    '''Keep the worker's own copy of the Spin, and its Figure.
+    '''
+    global _worker_spin
+    _worker_spin = spin
+
+def _render_spin_frames(frame_indices,times):
+    '''Render a chunk of the frames of a Spin in a worker, returning a list
+    of RGBA arrays and the stats of each frame.
+    '''
+    return [(frame.copy(),frame_stats) for frame,frame_stats in _worker_spin._iter_drawn_frames(frame_indices,times)]
+
+def iter_spin_frames_parallel(spin,frame_indices,times,workers,chunksize=4):
+    '''
+    Render frames of a Spin in a process pool, yielding their RGBA arrays and
+    stats in order (see iter_frames_parallel). Each frame only depends on its
+    time, so each worker renders its frames on its own copy of the Figure.
+    With "spawn", the Figure is pickled to the workers.
+    '''
+    frame_indices = np.asarray(frame_indices)
+    chunks = [frame_indices[i:i+chunksize] for i in range(0,len(frame_indices),chunksize)]
+    with concurrent.futures.ProcessPoolExecutor(workers,initializer=_init_spin_worker,initargs=(spin,)) as executor:
+        for frame,frame_stats in _iter_results(executor,_render_spin_frames,chunks,workers,times):
+            yield frame,frame_stats
+
+# the Videos of the jobs of a RenderPool, rebuilt in each worker process and
+# kept for the next chunks of the same job
+_job_videos = collections.OrderedDict()
+_MAX_JOB_VIDEOS = 4
+
+def _render_job_frames(fpath_spec,frame_indices):
+    '''Render a chunk of frames of a RenderPool job in a worker, loading the
+    job's Video from the file fpath_spec the first time.
+    '''
+    video = _job_videos.get(fpath_spec)
+    if video is None:
+        with open(fpath_spec,'rb') as f:
+            video = _build_video(*pickle.load(f))
+        _job_videos[fpath_spec] = video
+        while len(_job_videos) > _MAX_JOB_VIDEOS:
+            _job_videos.popitem(last=False)
+    _job_videos.move_to_end(fpath_spec)
+    return _render_chunk(video,frame_indices)
+
+class _JobStream:
+    '''The chunks of frames of one job of a RenderPool, and the futures of
+    the chunks submitted so far.
+    '''
+    def __init__(self,fpath_spec,chunks):
+        self.fpath_spec = fpath_spec
+        self.chunks = collections.deque(chunks)
+        self.futures = collections.deque()
+        self.closed = False
+
+class RenderPool:
+    '''
+    A long-lived pool of worker processes shared by several Videos, such as
+    render jobs running at the same time (see Video.submit). Pass it as the
+    workers argument of a Video's writing methods.
+
+    Chunks of frames are submitted to the workers from a single dispatching
+    thread, which takes turns between the jobs with frames left to draw, so
+    a long job doesn't hold up the others. At most 2*workers chunks are in
+    flight at once. Each job's Scenes are pickled once to a temporary file,
+    which each worker loads the first time it draws a frame of the job, so
+    the Scenes must be picklable: draw functions have to be defined at the
+    top level of a module, which with "fork" can be __main__ if they're
+    defined before the pool is created.
+
+    Parameters
+    ----------
+    workers : int.
+        The number of worker processes.
+
+    Methods
+    ----------
+    iter_frames : render frames of a Video in the pool
+    close : shut the pool down
+    '''
+
+    def __init__(self,workers=4):
+        self.workers = workers
+        self.max_in_flight = 2*workers
+        self._executor = concurrent.futures.ProcessPoolExecutor(workers)
+        self._cond = threading.Condition()
+        self._ready = collections.deque()
+        # the streams of the jobs running
+        self._streams = set()
+        self._in_flight = 0
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch,daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch(self):
+        '''Submit the next chunk of each job in turn while there is room in
+        the pool.
+        '''
+        with self._cond:
+            while not self._closed:
+                while self._in_flight < self.max_in_flight and self._ready:
+                    stream = self._ready.popleft()
+                    future = self._executor.submit(_render_job_frames,stream.fpath_spec,stream.chunks.popleft())
+                    stream.futures.append(future)
+                    self._in_flight += 1
+                    future.add_done_callback(self._chunk_done)
+                    if stream.chunks and len(stream.futures) < self.max_in_flight:
+                        self._ready.append(stream)
+                    self._cond.notify_all()
+                self._cond.wait()
+
+    def _chunk_done(self,future):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def iter_frames(self,video,frame_indices,chunksize=4):
+        '''
+        Render frames of a Video in the pool, yielding their RGBA arrays and
+        stats in order (see iter_frames_parallel).
+        '''
+        if self._closed:
+            raise RuntimeError('The RenderPool is closed')
+        frame_indices = np.asarray(frame_indices)
+        chunks = [frame_indices[i:i+chunksize] for i in range(0,len(frame_indices),chunksize)]
+        with tempfile.NamedTemporaryFile('wb',suffix='.pkl',delete=False) as f:
+            pickle.dump(_video_spec(video),f)
+        stream = _JobStream(f.name,chunks)
+        try:
+            with self._cond:
+                self._streams.add(stream)
+                stream.closed = self._closed
+                if stream.chunks and not stream.closed:
+                    self._ready.append(stream)
+                    self._cond.notify_all()
+            while True:
+                with self._cond:
+                    while not stream.futures and stream.chunks:
+                        # no more chunks are submitted once the pool closes
+                        if stream.closed:
+                            raise RuntimeError('The RenderPool is closed')
+                        self._cond.wait()
+                    if not stream.futures:
+                        return
+                    future = stream.futures.popleft()
+                    # make room for the next chunk of this job
+                    if stream.chunks and not stream.closed and stream not in self._ready:
+                        self._ready.append(stream)
+                        self._cond.notify_all()
+                for frame,frame_stats in future.result():
+                    yield frame,frame_stats
+        finally:
+            with self._cond:
+                self._streams.discard(stream)
+                stream.chunks.clear()
+                if stream in self._ready:
+                    self._ready.remove(stream)
+                for future in stream.futures:
+                    future.cancel()
+            os.remove(stream.fpath_spec)
+
+    def close(self):
+        '''
+        Shut the pool down, waiting for the chunks in flight. Jobs with
+        frames left to draw raise a RuntimeError once they have used up the
+        chunks already drawn.
+        '''
+        with self._cond:
+            self._closed = True
+            for stream in self._streams:
+                stream.closed = True
+            self._ready.clear()
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Hooks to follow and profile the rendering of a video.
+
+The writing methods of Video and Spin accept a list of hooks, each a callable
+called once per frame, after the frame is written, with a dict describing it:
+
+    frame : the index of the frame
+    n_frames : the total number of frames in the video
+    scene : the index of the Scene the frame belongs to
+    video_time, indextime : the video time and index time of the frame
+    timing : seconds spent updating the Timing for the frame
+    draw : seconds spent drawing the frame (draw_fig_func or update_func)
+    rasterize : seconds spent rendering the Figure to pixels, or reading the
+        frame from a FrameCache
+    encode : seconds spent handing the frame to the writer (which includes
+        waiting for ffmpeg when the writer's queue is full), or saving it as
+        an image with savefig (which also renders it)
+    cached, repeated : whether the frame was read from a FrameCache, or
+        repeated from the previous frame of a static Scene, without drawing
+    transition : whether the frame belongs to a transition between Scenes,
+        and was blended from the frames either side of it (its scene is the
+        outgoing Scene, and the blending time counts as rasterize)
+    peak_rss : the peak resident memory, in bytes, of the process which drew
+        the frame, or None where it isn't available
+    rss, pid : the resident memory, in bytes, of the process which drew the
+        frame just after drawing it, and the id of that process (only for
+        frames which were drawn)
+    recycled : whether the Figure was replaced before drawing the frame, as
+        the process had gone over the Video's max_rss
+
+Nothing is printed during rendering unless a ProgressPrinter is passed as
+a hook.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+STAGES = ['timing','draw','rasterize','encode']
+
+def peak_rss():
+    '''
+    Return the peak resident memory of this process, in bytes, or None if it
+    can't be measured.
+    '''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+def current_rss():
+    '''
+    Return the current resident memory of this process, in bytes. Where it
+    can't be read (outside Linux), the peak is returned instead.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError,ValueError,AttributeError):
+        return peak_rss()
+
+def new_frame_stats(**stats):
+    '''Return the stats of a frame with every stage at zero.
+    '''
+    frame_stats = {stage:0. for stage in STAGES}
+    frame_stats['cached'] = False
+    frame_stats['repeated'] = False
+    frame_stats['recycled'] = False
+    frame_stats.update(stats)
+    return frame_stats
+
+class Stopwatch:
+    '''
+    Context manager adding the time spent within it to stats[stage].
+    '''
+    def __init__(self,stats,stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.stats[self.stage] += time.perf_counter()-self.start
+
+def call_hooks(hooks,frame_stats):
+    '''Call each of the hooks with the stats of a frame.
+    '''
+    if hooks is None:
+        return
+    if frame_stats.get('peak_rss') is None:
+        frame_stats['peak_rss'] = peak_rss()
+    for hook in hooks:
+        hook(frame_stats)
+
+class ProgressPrinter:
+    '''
+    Hook printing a line as each frame is written.
+    '''
+    def __call__(self,frame_stats):
+        print('Writing frame '+str(frame_stats['frame'])+'/'+str(frame_stats['n_frames'])+'...')
+
+class RenderProfiler:
+    '''
+    Hook collecting the stats of every frame, to report where the rendering
+    time goes in each Scene.
+
+    Attributes
+    ----------
+    frames : list of dict.
+        The stats of each frame, as passed to the hook.
+
+    Methods
+    ----------
+    report : aggregate the stats for each Scene
+    slowest : the stats of the slowest frames
+    summary : a printable summary of the report
+    '''
+
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self,frame_stats):
+        self.frames.append(dict(frame_stats))
+
+    def _total_time(self,frame_stats):
+        return sum(frame_stats[stage] for stage in STAGES)
+
+    def slowest(self,n=5):
+        '''
+        Return the stats of the n frames which took the longest in total.
+        '''
+        return sorted(self.frames,key=self._total_time,reverse=True)[:n]
+
+    def report(self):
+        '''
+        Aggregate the stats for each Scene.
+
+        Returns
+        ----------
+        report : dict
+            For each Scene index, a dict with the number of frames 'count',
+            the number of 'cached' and 'repeated' frames, the 'peak_rss' seen,
+            the 'rss_growth' and number of times the Figure was 'recycled'
+            (see rss_growth), and for each stage and the 'total', a dict of
+            the 'p50', 'p95' and 'max' times and the 'sum' of the times, in
+            seconds.
+        '''
+        growth = self.rss_growth()
+        report = {}
+        scenes = sorted(set(f['scene'] for f in self.frames))
+        for scene in scenes:
+            frames = [f for f in self.frames if f['scene'] == scene]
+            scene_report = {'count':len(frames),
+                            'cached':sum(f['cached'] for f in frames),
+                            'repeated':sum(f['repeated'] for f in frames)}
+            rss = [f['peak_rss'] for f in frames if f.get('peak_rss') is not None]
+            scene_report['peak_rss'] = max(rss) if rss else None
+            scene_report['rss_growth'] = growth.get(scene,0)
+            scene_report['recycled'] = sum(f.get('recycled',False) for f in frames)
+            for stage in STAGES+['total']:
+                if stage == 'total':
+                    times = np.array([self._total_time(f) for f in frames])
+                else:
+                    times = np.array([f[stage] for f in frames])
+                scene_report[stage] = {'p50':float(np.percentile(times,50)),
+                                       'p95':float(np.percentile(times,95)),
+                                       'max':float(np.max(times)),
+                                       'sum':float(np.sum(times))}
+            report[scene] = scene_report
+        return report
+
+    def rss_growth(self):
+        '''
+        Return, for each Scene index, the total growth of the resident memory
+        over the frames of the Scene, in bytes: the sum of the increases in
+        RSS from the previous frame drawn by the same process. Memory which
+        keeps growing through a Scene points to its drawing function leaving
+        things behind. Drops, as when the Figure is recycled, aren't counted.
+        '''
+        growth = {}
+        last_rss = {}
+        for f in sorted(self.frames,key=lambda f: f['frame']):
+            if f.get('rss') is None:
+                continue
+            prev = last_rss.get(f['pid'])
+            if prev is not None and f['rss'] > prev:
+                growth[f['scene']] = growth.get(f['scene'],0)+f['rss']-prev
+            last_rss[f['pid']] = f['rss']
+        return growth
+        
+    def summary(self,n_slowest=5):
+        '''
+        Return a printable summary of the report and the slowest frames, with
+        times in milliseconds.
+        '''
+        lines = []
+        for scene,scene_report in self.report().items():
+            lines.append('Scene '+str(scene)+': '+str(scene_report['count'])+' frames ('
+                         +str(scene_report['cached'])+' cached, '+str(scene_report['repeated'])+' repeated)'
+                         +('' if scene_report['peak_rss'] is None else ', peak RSS '+'{:.0f}'.format(scene_report['peak_rss']/2**20)+' MB')
+                         +', RSS growth '+'{:.1f}'.format(scene_report['rss_growth']/2**20)+' MB'
+                         +('' if not scene_report['recycled'] else ', figure recycled '+str(scene_report['recycled'])+' times'))
+            for stage in STAGES+['total']:
+                r = scene_report[stage]
+                lines.append('    {:10s} p50 {:8.2f}  p95 {:8.2f}  max {:8.2f}  sum {:10.1f}'.format(
+                    stage,1e3*r['p50'],1e3*r['p95'],1e3*r['max'],1e3*r['sum']))
+        lines.append('Slowest frames:')
+        for f in self.slowest(n_slowest):
+            lines.append('    frame '+str(f['frame'])+' (scene '+str(f['scene'])+', index time '
+                         +str(f['indextime'])+'): '+'{:.2f}'.format(1e3*self._total_time(f))+' ms')
+        return '\n'.join(lines)
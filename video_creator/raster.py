@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to rasterize a matplotlib Figure into an array of RGBA pixels.
+"""
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+def get_agg_canvas(fig):
+    '''
+    Return the canvas of the Figure, attaching an Agg canvas to it if its
+    current canvas can't render to an RGBA buffer.
+    '''
+    if not hasattr(fig.canvas,'buffer_rgba'):
+        FigureCanvasAgg(fig)
+    return fig.canvas
+
+def rasterize(fig):
+    '''
+    Render the Figure and return its pixels.
+
+    Parameters
+    ----------
+    fig : matplotlib Figure
+        The figure to render.
+
+    Returns
+    ----------
+    frame : np.ndarray
+        Array of shape (height,width,4) and dtype uint8. This is a view of the
+        canvas's buffer, so it is overwritten the next time the Figure is
+        drawn; copy it if it has to be kept.
+    '''
+    canvas = get_agg_canvas(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())
@@ -5,12 +5,29 @@ Created on Mon Nov 11 14:53:18 2019
 @author: Daniel Ruth
 """
 
+import numpy as np
+from matplotlib.artist import Artist
+from .raster import rasterize, get_agg_canvas
+
+def _iter_artists(artists):
+    '''Yield the matplotlib Artists held in any nesting of lists, tuples,
+    sets and dicts.
+    '''
+    if isinstance(artists,Artist):
+        yield artists
+    elif isinstance(artists,dict):
+        for a in artists.values():
+            yield from _iter_artists(a)
+    elif isinstance(artists,(list,tuple,set)):
+        for a in artists:
+            yield from _iter_artists(a)
+
 class Scene:
     '''
     Describes one portion of a video.
     '''
     
-    def __init__(self,draw_fig_func,timing):
+    def __init__(self,draw_fig_func,timing,static=False):
         '''
         Parameters
         ----------        
@@ -22,9 +39,38 @@ class Scene:
             
         timing : Timing.
             Instance of the Timing class to control the timing for the Scene.        
+            
+        static : bool.
+            Set to True if the frame only depends on the index time, and not
+            on the scene time or playback rate. Consecutive frames with the
+            same index time, such as in a title card or a pause, are then
+            drawn only once.
         '''
         self.draw_fig_func = draw_fig_func
         self.timing = timing
+        self.static = static
+        
+    def activate(self,fig):
+        '''
+        Prepare the Figure when the Scene becomes the one being drawn, such as
+        when a Video moves on to it from another Scene. Nothing is needed here
+        since the Figure is cleared for every frame.
+        '''
+        pass
+    
+    def release(self):
+        '''
+        Drop any reference to the Figure, such as when a Video replaces its
+        Figure. Nothing is kept here.
+        '''
+        pass
+    
+    def rasterize(self,fig):
+        '''
+        Render the Figure as drawn for the current frame, returning its RGBA
+        pixels (see raster.rasterize).
+        '''
+        return rasterize(fig)
         
     def __call__(self,ix_time,fig):
         '''
@@ -51,7 +97,7 @@ class Scene:
         # draw on the axes
         self.draw_fig_func(ix_time,fig,timing=self.timing)
     
-    def draw_at_stime(self,stime,fig):
+    def draw_at_stime(self,stime,fig,indextime=None,playback_rate=None):
         '''
         Draw the frame at the given scene time (playback time into the scene).
         Involves updating the Timing instance with the scene time to find the 
@@ -64,7 +110,141 @@ class Scene:
             
         fig : matplotlib Figure
             The figure on which to draw the frame.
+            
+        indextime, playback_rate : float, or None
+            The index time and playback rate at stime, if they are already
+            known. Otherwise they are computed with the Timing instance.
         '''
-        self.timing.update_with_stime(stime)
+        self.timing.update_with_stime(stime,indextime=indextime,playback_rate=playback_rate)
         ix_time = self.timing.current_indextime
-        self(ix_time,fig)
\ No newline at end of file
+        self(ix_time,fig)
+        
+class UpdateScene(Scene):
+    '''
+    Describes one portion of a video whose artists are created once, when the
+    Scene becomes active, and only updated for each frame. This avoids
+    rebuilding the axes, ticks and labels for every frame, as Scene does.
+    
+    With static_background=True, everything on the Figure other than the
+    artists returned by setup_func is treated as a static layer. It is
+    rendered once when the Scene becomes active, and each frame is made by
+    restoring that layer and drawing only the returned artists on top of it,
+    like matplotlib's blitting. The returned artists are always drawn above
+    the static layer, regardless of their zorder, and they can include whole
+    Axes when everything in them changes.
+    '''
+    
+    def __init__(self,setup_func,update_func,timing,static_background=False,static=False):
+        '''
+        Parameters
+        ----------
+        setup_func : callable.
+            Function to set up the figure. Must accept the Figure, and
+            optionally an instance of Timing as the keyword argument timing.
+            Returns the artists (in any container, such as a list or dict)
+            which update_func changes for each frame.
+            
+        update_func : callable.
+            Function to update the artists for a frame. Must accept two inputs:
+                - the index time at which to draw the Figure
+                - the artists returned by setup_func
+            and optionally an instance of Timing as the keyword argument
+            timing. It should only change the existing artists, as with
+            set_data, set_offsets or set_text.
+            
+        timing : Timing.
+            Instance of the Timing class to control the timing for the Scene.
+            
+        static_background : bool.
+            Whether to render everything but the artists returned by
+            setup_func once, and reuse it for every frame.
+            
+        static : bool.
+            Set to True if the frame only depends on the index time (see
+            Scene).
+        '''
+        self.setup_func = setup_func
+        self.update_func = update_func
+        self.timing = timing
+        self.static_background = static_background
+        self.static = static
+        self.artists = None
+        self._fig = None
+        self._background = None
+        self._dynamic_artists = None
+        
+    def __getstate__(self):
+        # the artists and static layer belong to the Figure they were made
+        # on, so a copy of the Scene sets itself up again on its own Figure
+        state = self.__dict__.copy()
+        for key in ('artists','_fig','_background','_dynamic_artists'):
+            state[key] = None
+        return state
+        
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        
+    def activate(self,fig):
+        '''
+        Clear the Figure and create the Scene's artists on it.
+        '''
+        fig.clf()
+        self.artists = self.setup_func(fig,timing=self.timing)
+        self._fig = fig
+        
+        # render the static layer without the artists which are updated
+        if self.static_background:
+            self._dynamic_artists = list(_iter_artists(self.artists))
+            # animated artists are left out of the draw, only for as long as
+            # it takes, so the Figure still draws them when saved or shown
+            animated = [a.get_animated() for a in self._dynamic_artists]
+            for a in self._dynamic_artists:
+                a.set_animated(True)
+            canvas = get_agg_canvas(fig)
+            try:
+                canvas.draw()
+            finally:
+                for a,was_animated in zip(self._dynamic_artists,animated):
+                    a.set_animated(was_animated)
+            self._background = canvas.copy_from_bbox(fig.bbox)
+            
+    def release(self):
+        '''
+        Drop the artists and static layer made on the Figure, so the Scene is
+        set up again on the next frame.
+        '''
+        self.artists = None
+        self._fig = None
+        self._background = None
+        self._dynamic_artists = None
+        
+    def rasterize(self,fig):
+        '''
+        Render the Figure as drawn for the current frame, returning its RGBA
+        pixels. With a static background, only the artists returned by
+        setup_func are drawn, on top of the saved static layer.
+        '''
+        if self._background is None or fig is not self._fig:
+            return rasterize(fig)
+        canvas = get_agg_canvas(fig)
+        canvas.restore_region(self._background)
+        for a in self._dynamic_artists:
+            fig.draw_artist(a)
+        return np.asarray(canvas.buffer_rgba())
+        
+    def __call__(self,ix_time,fig):
+        '''
+        Update the artists for the given index time, setting up the Figure
+        first if it hasn't been set up for this Scene.
+        
+        Parameters
+        ----------
+        ix_time : float
+            The index time at which to draw the frame.
+            
+        fig : matplotlib Figure
+            The figure on which to draw the frame.
+        '''
+        if self._fig is not fig:
+            self.activate(fig)
+        self.update_func(ix_time,self.artists,timing=self.timing)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to write a Video as separately encoded segments of consecutive frames
+and to stitch the segments back together with ffmpeg's concat demuxer,
+without re-encoding them.
+
+Each segment is described by a JSON manifest saved next to it, recording
+which frames of the Video it holds and their video times, so the segments
+can be checked against the Video before they are merged.
+"""
+
+import os
+import json
+import subprocess
+import tempfile
+import numpy as np
+import matplotlib as mpl
+
+def shard_frames(n_frames,shard,n_shards):
+    '''
+    Return the indices of the contiguous range of frames making up shard
+    number shard (counting from 0) when n_frames frames are split into
+    n_shards shards of nearly equal length. Each shard holds at least one
+    frame, so there can't be more shards than frames.
+    '''
+    if n_shards > n_frames:
+        raise ValueError('Cannot split '+str(n_frames)+' frames into '+str(n_shards)+' shards')
+    if not 0 <= shard < n_shards:
+        raise ValueError('shard must be between 0 and n_shards-1, got '+str(shard))
+    bounds = np.linspace(0,n_frames,n_shards+1).round().astype(int)
+    return np.arange(bounds[shard],bounds[shard+1])
+
+def manifest_path(fpath_segment):
+    '''The path of the manifest describing a segment.
+    '''
+    return fpath_segment+'.json'
+
+def write_manifest(fpath_segment,video,frame_indices):
+    '''
+    Write the manifest describing a segment holding the given frames of a
+    Video.
+    '''
+    manifest = {'segment':os.path.basename(fpath_segment),
+                'first_frame':int(frame_indices[0]),
+                'n_frames':len(frame_indices),
+                'first_video_time':float(video.video_times[frame_indices[0]]),
+                'last_video_time':float(video.video_times[frame_indices[-1]]),
+                'fps':video.fps,
+                'n_video_frames':len(video.video_times)}
+    with open(manifest_path(fpath_segment),'w') as f:
+        json.dump(manifest,f,indent=1)
+    return manifest
+
+def read_manifest(fpath_segment):
+    '''
+    Read the manifest of a segment, or return None if it doesn't exist. The
+    segment's path is set to fpath_segment, since the segment may have been
+    written on another machine.
+    '''
+    try:
+        with open(manifest_path(fpath_segment)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    manifest['segment'] = fpath_segment
+    return manifest
+
+def check_manifests(manifests,video):
+    '''
+    Check that the segments described by a list of manifests hold every frame
+    of the Video exactly once, with matching video times. Returns the
+    manifests sorted by their first frame; raises ValueError otherwise.
+    '''
+    manifests = sorted(manifests,key=lambda m: m['first_frame'])
+    next_frame = 0
+    for m in manifests:
+        if m['fps'] != video.fps or m['n_video_frames'] != len(video.video_times):
+            raise ValueError('Segment '+m['segment']+' was written for a different video')
+        if m['first_frame'] != next_frame:
+            raise ValueError('Expected a segment starting at frame '+str(next_frame)+', got '+m['segment']+' starting at frame '+str(m['first_frame']))
+        last_frame = m['first_frame']+m['n_frames']-1
+        if not (np.isclose(m['first_video_time'],video.video_times[m['first_frame']])
+                and np.isclose(m['last_video_time'],video.video_times[last_frame])):
+            raise ValueError('The video times of segment '+m['segment']+' do not match the video')
+        next_frame = last_frame+1
+    if next_frame != len(video.video_times):
+        raise ValueError('The segments hold '+str(next_frame)+' of the '+str(len(video.video_times))+' frames')
+    return manifests
+
+def concat_segments(fpath_segments,fpath_video):
+    '''
+    Join encoded segments into a single video file using ffmpeg's concat
+    demuxer, copying the streams without re-encoding them.
+    '''
+    with tempfile.NamedTemporaryFile('w',suffix='.txt',delete=False) as f:
+        for fpath_segment in fpath_segments:
+            f.write("file '"+os.path.abspath(fpath_segment).replace("'","'\\''")+"'\n")
+        fpath_list = f.name
+    try:
+        subprocess.run([str(mpl.rcParams['animation.ffmpeg_path']),'-loglevel','error',
+                        '-f','concat','-safe','0','-i',fpath_list,'-c','copy','-y',fpath_video],
+                       check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    finally:
+        os.remove(fpath_list)
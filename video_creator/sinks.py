@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Outputs fed from a single render of a Video.
+
+Video.write_outputs draws each frame once and hands its RGBA pixels to every
+sink which wants it, so a high quality video, a low bitrate one, a downscaled
+preview and a poster image cost one render between them. Each sink chooses
+its frames (all of them, a slice, or a list of indices), and a scale, applied
+with an ffmpeg filter for videos and in NumPy for images.
+"""
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.image
+from .writer import FFMpegRawWriter
+from .images import image_format
+
+def _frame_mask(frames,n_frames):
+    '''Return a boolean mask of the frames selected by None (all of them), a
+    slice, or an array-like of frame indices.
+    '''
+    mask = np.zeros(n_frames,dtype=bool)
+    if frames is None:
+        mask[:] = True
+    else:
+        mask[frames] = True
+    return mask
+
+def scale_frame(frame,scale):
+    '''
+    Resize a (height,width,4) RGBA frame by a factor scale. Reductions by an
+    integer factor average blocks of pixels; other factors pick the nearest
+    pixel.
+    '''
+    if scale == 1:
+        return frame
+    height,width = frame.shape[:2]
+    factor = 1./scale
+    if factor > 1 and abs(factor-round(factor)) < 1e-9:
+        k = int(round(factor))
+        h,w = height//k*k,width//k*k
+        blocks = frame[:h,:w].reshape(h//k,k,w//k,k,frame.shape[2])
+        return blocks.mean(axis=(1,3)).round().astype(frame.dtype)
+    rows = np.minimum(((np.arange(max(int(round(height*scale)),1))+0.5)*factor).astype(int),height-1)
+    cols = np.minimum(((np.arange(max(int(round(width*scale)),1))+0.5)*factor).astype(int),width-1)
+    return frame[rows][:,cols]
+
+class VideoSink:
+    '''
+    Encode frames of a Video to a video file with ffmpeg.
+
+    Parameters
+    ----------
+    fpath_video : str.
+        The path of the video file to write.
+
+    frames : None, slice, or array-like of int.
+        The frames of the Video to encode, by default all of them.
+
+    scale : float.
+        The factor by which ffmpeg resizes the frames (to even dimensions, as
+        needed for yuv420p).
+
+    fps : float, or None.
+        The frames per second of the file, by default that of the Video. Set
+        this when frames skips frames evenly, e.g. fps=video.fps/2 with
+        frames=slice(None,None,2), to keep the duration.
+
+    **writer_kwargs
+        Passed to FFMpegRawWriter, such as codec, bitrate, extra_args,
+        metadata or queue_size.
+    '''
+
+    def __init__(self,fpath_video,frames=None,scale=1,fps=None,**writer_kwargs):
+        self.fpath_video = fpath_video
+        self.frames = frames
+        self.scale = scale
+        self.fps = fps
+        self.writer_kwargs = writer_kwargs
+        self.mask = None
+        self._writer = None
+
+    def open(self,video):
+        '''
+        Select the frames of the Video and prepare the writer.
+        '''
+        self.mask = _frame_mask(self.frames,len(video.video_times))
+        writer_kwargs = dict(self.writer_kwargs)
+        if self.scale != 1:
+            extra_args = writer_kwargs.get('extra_args')
+            extra_args = list(mpl.rcParams['animation.ffmpeg_args']) if extra_args is None else list(extra_args)
+            scale_filter = 'scale=trunc(iw*%g/2)*2:trunc(ih*%g/2)*2' % (self.scale,self.scale)
+            if '-vf' in extra_args:
+                # scale ahead of the filters already given
+                i = extra_args.index('-vf')+1
+                extra_args[i] = scale_filter+','+extra_args[i]
+            else:
+                extra_args += ['-vf',scale_filter]
+            writer_kwargs['extra_args'] = extra_args
+        self._writer = FFMpegRawWriter(self.fpath_video,video.fps if self.fps is None else self.fps,**writer_kwargs)
+
+    def write(self,fi,frame):
+        '''
+        Encode frame fi, if it is one of the frames of this sink.
+        '''
+        if self.mask[fi]:
+            self._writer.write(frame)
+
+    def close(self):
+        '''
+        Finish encoding the file.
+        '''
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if self._writer is not None:
+            self._writer.__exit__(exc_type,exc_value,traceback)
+
+class ImageSink:
+    '''
+    Save a single frame of a Video as an image, such as a poster frame.
+
+    Parameters
+    ----------
+    fpath : str.
+        The path of the image, with the extension of a raster format.
+
+    frame : int.
+        The index of the frame to save; negative indices count from the end.
+
+    scale : float.
+        The factor by which the frame is resized, in NumPy.
+
+    dpi : float, or None.
+        The dpi to record in the image's metadata.
+    '''
+
+    def __init__(self,fpath,frame=0,scale=1,dpi=None):
+        self.fpath = fpath
+        self.frame = frame
+        self.scale = scale
+        self.dpi = dpi
+        self.mask = None
+        self._dpi = dpi
+
+    def open(self,video):
+        '''
+        Select the frame of the Video.
+        '''
+        self.mask = _frame_mask([self.frame],len(video.video_times))
+        self._dpi = video.fig.dpi*self.scale if self.dpi is None else self.dpi
+
+    def write(self,fi,frame):
+        '''
+        Save frame fi, if it is the frame of this sink.
+        '''
+        if self.mask[fi]:
+            matplotlib.image.imsave(self.fpath,scale_frame(frame,self.scale),dpi=self._dpi,format=image_format(self.fpath))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
@@ -6,14 +6,38 @@ Created on Mon Jan  6 12:20:39 2020
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as manimation
-import copy
+from .profiling import new_frame_stats, Stopwatch, call_hooks
+from .raster import rasterize
+from .images import ImageWriterPool, FrameStackWriter, is_raster_extension
+from .writer import FFMpegRawWriter
+from .gif import GifWriter, WebPWriter, PaletteQuantizer, build_palette, sample_indices
+from .parallel import iter_spin_frames_parallel
+from .cache import MemoryFrameCache
+from .scene import UpdateScene
+from .timing import LinearPlaybackDefinedDuration
+
+def spin_azimuths(times,period,azim_init,oscillate=False,oscillate_amplitude=45.):
+    '''
+    Return the azimuth (in degrees) of each of the axes at each of the times,
+    as an array of shape (n_times,n_axes), for axes spinning around the z
+    axis (see Spin).
+    '''
+    times = np.asarray(times,dtype=float)[:,None]
+    azim_init = np.asarray(azim_init,dtype=float).reshape(1,-1)
+    if oscillate:
+        return azim_init + oscillate_amplitude * np.sin(times/period*2*np.pi)
+    return azim_init+times/period*360.
 
 class Spin:
     '''
     Class to animate a 3d plot spinning around the z axis.
     
+    The frames only depend on the azimuths, so they can be rendered across a
+    pool of worker processes (workers), each with its own copy of the
+    Figure. When oscillating, the same azimuths come back several times; the
+    frames of azimuths which come back are kept in memory (up to
+    replay_bytes) and replayed instead of being rendered again.
+    
     Parameters
     ----------
     fig : matplotlib Figure.
@@ -40,6 +64,9 @@ class Spin:
     ----------
     write_video : save the animation as a video file.
     write_images : save the animation as a sequence of images.  
+    write_frame_stack : save the animation as a .npy array of frames.
+    write_gif : save the animation as an animated GIF.
+    write_webp : save the animation as an animated WebP file.
     '''
     
     def __init__(self,fig,ax,period=3,azim_init=-60,oscillate=False,oscillate_amplitude=45.):
@@ -62,40 +89,192 @@ class Spin:
         times = np.arange(0,self.period-dt,dt)
         return times
     
+    def _azimuths(self,times):
+        '''the azimuth of each axes at each time
+        '''
+        return spin_azimuths(times,self.period,self.azim_init,self.oscillate,self.oscillate_amplitude)
+    
     def _update_axes(self,time):
         '''update the azimuth on each axes given the time
         '''
-        for ax,azim_init in zip(self.ax,self.azim_init):
-            if self.oscillate == False:
-                ax.azim = azim_init+time/self.period*360.
-            if self.oscillate == True:
-                ax.azim =  azim_init + self.oscillate_amplitude * np.sin(time/self.period*2*np.pi)
+        for ax,azim in zip(self.ax,self._azimuths([time])[0]):
+            ax.azim = azim
+    
+    def _frame_stats(self,ti,times):
+        '''Start the stats of frame ti for the hooks (see the profiling
+        module), timing the update of the azimuths.
+        '''
+        frame_stats = new_frame_stats(frame=int(ti),n_frames=len(times),scene=0,
+                                      video_time=float(times[ti]),indextime=float(times[ti]))
+        with Stopwatch(frame_stats,'draw'):
+            self._update_axes(times[ti])
+        return frame_stats
+    
+    def _render_frame(self,ti,times):
+        '''Draw frame ti on self.fig and return its RGBA pixels, as a view of
+        the canvas buffer, and its stats.
+        '''
+        frame_stats = self._frame_stats(ti,times)
+        with Stopwatch(frame_stats,'rasterize'):
+            frame = rasterize(self.fig)
+        return frame,frame_stats
+    
+    def _iter_drawn_frames(self,frame_indices,times):
+        '''Draw each of the frames on self.fig, yielding its pixels and stats.
+        '''
+        for ti in frame_indices:
+            yield self._render_frame(ti,times)
     
-    def write_video(self,fpath_video,fps=30,metadata_dict=None):
-        '''Save the animation as a video file.
+    def _iter_frames(self,fps,workers=None,chunksize=4,replay_bytes=2**28):
+        '''Yield the RGBA pixels of each frame, and its stats. The first
+        frame of each set of azimuths is rendered, on self.fig or in a pool
+        of workers; frames whose azimuths were seen before are replayed from
+        memory if they are still held, and drawn again on self.fig otherwise.
+        '''
+        times = self._compute_frame_times(fps)
+        
+        # frames at the same azimuths, up to rounding errors, are identical
+        keys = [tuple(a) for a in np.round(self._azimuths(times),6)]
+        first_frames = {}
+        last_frames = {}
+        for ti,key in enumerate(keys):
+            first_frames.setdefault(key,ti)
+            last_frames[key] = ti
+        first_indices = sorted(first_frames.values())
+        
+        if workers is not None and workers > 1:
+            rendered = iter_spin_frames_parallel(self,first_indices,times,workers,chunksize=chunksize)
+        else:
+            rendered = self._iter_drawn_frames(first_indices,times)
+            
+        replay = MemoryFrameCache(replay_bytes)
+        for ti,key in enumerate(keys):
+            if first_frames[key] == ti:
+                frame,frame_stats = next(rendered)
+                if last_frames[key] > ti:
+                    replay.put(key,frame.copy())
+            else:
+                frame_stats = new_frame_stats(frame=ti,n_frames=len(times),scene=0,repeated=True,
+                                              video_time=float(times[ti]),indextime=float(times[ti]))
+                frame = replay.get(key)
+                if frame is None:
+                    frame,frame_stats = self._render_frame(ti,times)
+            yield frame,frame_stats
+    
+    def write_video(self,fpath_video,fps=30,metadata_dict=None,hooks=None,workers=None,chunksize=4,replay_bytes=2**28,**writer_kwargs):
+        '''Save the animation as a video file, with FFMpegRawWriter (see
+        Video.write_video). Frames are rendered across workers processes if
+        workers is greater than 1, and up to replay_bytes of frames are kept
+        to be replayed when their azimuths come back.
         '''        
-        times = self._compute_frame_times(fps)        
         if metadata_dict is None:
             metadata_dict = {}
+        with FFMpegRawWriter(fpath_video,fps,metadata=metadata_dict,**writer_kwargs) as writer:
+            for frame,frame_stats in self._iter_frames(fps,workers,chunksize,replay_bytes):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(frame)
+                call_hooks(hooks,frame_stats)
+                
+    def write_images(self,directory,fps=30,extension='.png',hooks=None,io_threads=4,**kwargs):
+        '''Save each frame as an image in a directory. Raster images are
+        written from the rendered pixels by io_threads threads (see
+        Video.write_images); kwargs are workers, chunksize and replay_bytes,
+        as in write_video.
+        '''
+        times = self._compute_frame_times(fps)
+        n_digits = len(str(int(len(times))))
+        fpaths = [directory+'frame_'+str(ti).zfill(n_digits)+extension for ti in range(len(times))]
         
-        # create the writer for the video file
-        FFMpegWriter = copy.deepcopy(manimation.writers['ffmpeg'])
-        writer = copy.deepcopy(FFMpegWriter(fps=fps, metadata=metadata_dict))
-        with writer.saving(self.fig, fpath_video, 100):
+        # vector formats have to be saved from the figure
+        if not is_raster_extension(extension):
+            for ti in range(len(times)):
+                frame_stats = self._frame_stats(ti,times)
+                with Stopwatch(frame_stats,'encode'):
+                    self.fig.savefig(fpaths[ti])
+                call_hooks(hooks,frame_stats)
+            return
             
-            # write each frame
-            for ti,time in enumerate(times):
-                print('Writing frame '+str(ti)+'/'+str(len(times))+'...')
-                self._update_axes(time)
-                writer.grab_frame()
+        with ImageWriterPool(io_threads,dpi=self.fig.dpi) as image_writer:
+            for ti,(frame,frame_stats) in enumerate(self._iter_frames(fps,**kwargs)):
+                with Stopwatch(frame_stats,'encode'):
+                    image_writer.save(fpaths[ti],frame)
+                call_hooks(hooks,frame_stats)
                 
-    def write_images(self,directory,fps=30,extension='.png'):
-        '''Save each frame as an image in a directory.
+    def write_frame_stack(self,fpath_npy,fps=30,hooks=None,**kwargs):
+        '''Write every frame into a single .npy file holding an array of
+        shape (n_frames,height,width,4) and dtype uint8 (see
+        Video.write_frame_stack); kwargs are workers, chunksize and
+        replay_bytes, as in write_video.
         '''
-        print('Writing the images')
         times = self._compute_frame_times(fps)
-        n_digits = len(str(int(len(times))))
-        for ti,time in enumerate(times):
-            print('Writing frame '+str(ti)+'/'+str(len(times))+'...')
-            self._update_axes(time)
-            self.fig.savefig(directory+'frame_'+str(ti).zfill(n_digits)+extension)
+        with FrameStackWriter(fpath_npy,len(times)) as stack_writer:
+            for frame,frame_stats in self._iter_frames(fps,**kwargs):
+                with Stopwatch(frame_stats,'encode'):
+                    stack_writer.write(frame)
+                call_hooks(hooks,frame_stats)
+                
+    def write_gif(self,fpath_gif,fps=30,n_colors=256,dither=False,n_samples=16,loop=0,hooks=None,**kwargs):
+        '''Save the animation as an animated GIF, with a palette of up to
+        n_colors colors built from n_samples frames drawn on self.fig (see
+        Video.write_gif); kwargs are workers, chunksize and replay_bytes, as
+        in write_video.
+        '''
+        times = self._compute_frame_times(fps)
+        samples = [self._render_frame(ti,times)[0].copy() for ti in sample_indices(len(times),n_samples)]
+        quantizer = PaletteQuantizer(build_palette(samples,n_colors),dither=dither)
+        with GifWriter(fpath_gif,fps,loop=loop) as writer:
+            for frame,frame_stats in self._iter_frames(fps,**kwargs):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(quantizer.quantize(frame),quantizer.palette)
+                call_hooks(hooks,frame_stats)
+                
+    def write_webp(self,fpath_webp,fps=30,quality=80,lossless=False,loop=0,hooks=None,**kwargs):
+        '''Save the animation as an animated WebP file, holding the frames
+        in memory until the end (see Video.write_webp); kwargs are workers,
+        chunksize and replay_bytes, as in write_video.
+        '''
+        with WebPWriter(fpath_webp,fps,loop=loop,lossless=lossless,quality=quality) as writer:
+            for frame,frame_stats in self._iter_frames(fps,**kwargs):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(frame)
+                call_hooks(hooks,frame_stats)
+                
+class SpinScene(UpdateScene):
+    '''
+    A Scene of a Video spinning 3d axes around the z axis, like Spin. The
+    index time is the time into the spin, in seconds, so with the default
+    Timing the Scene lasts one period.
+    
+    Parameters
+    ----------
+    setup_func : callable.
+        Function creating the 3d axes on the Figure. Must accept the Figure,
+        and optionally an instance of Timing as the keyword argument timing,
+        and return the axes to spin (an Axes or a list of Axes).
+        
+    timing : Timing, or None.
+        The Timing of the Scene. Defaults to one period played in real time.
+        
+    period, azim_init, oscillate, oscillate_amplitude
+        As in Spin; azim_init is given for each of the axes when setup_func
+        returns a list.
+    '''
+    
+    def __init__(self,setup_func,timing=None,period=3,azim_init=-60,oscillate=False,oscillate_amplitude=45.):
+        if timing is None:
+            timing = LinearPlaybackDefinedDuration(0,period,period)
+        super().__init__(setup_func,self._update_axes,timing,static=True)
+        self.period = period
+        self.azim_init = azim_init
+        self.oscillate = oscillate
+        self.oscillate_amplitude = oscillate_amplitude
+        
+    def _update_axes(self,ix_time,axes,timing=None):
+        '''Set the azimuth of each axes for the index time.
+        '''
+        if type(axes) is not list:
+            axes = [axes,]
+        azim_init = self.azim_init if type(self.azim_init) is list else [self.azim_init]*len(axes)
+        azimuths = spin_azimuths([ix_time],self.period,azim_init,self.oscillate,self.oscillate_amplitude)[0]
+        for ax,azim in zip(axes,azimuths):
+            ax.azim = azim
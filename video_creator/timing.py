@@ -6,7 +6,25 @@ Created on Mon Nov 11 14:51:46 2019
 """
 
 import numpy as np
-import scipy.optimize
+
+def _broadcast(value,stime):
+    '''Return value with the same shape as stime.
+    '''
+    return np.full(np.shape(stime),value,dtype=float)[()]
+
+def _call_on_array(func,stime):
+    '''Call func, a method of a Timing, on an array of scene times at once,
+    or on each scene time in turn when it only handles single values, as
+    Timings defined outside this module may.
+    '''
+    stime = np.asarray(stime,dtype=float)
+    try:
+        res = np.asarray(func(stime),dtype=float)
+        if res.shape == stime.shape:
+            return res
+    except (TypeError,ValueError):
+        pass
+    return np.array([func(float(s)) for s in stime.ravel()],dtype=float).reshape(stime.shape)
 
 class Timing:
     '''
@@ -14,7 +32,8 @@ class Timing:
     indexed) and the "scene time" (the actual playback time) for a Scene.
     
     The method .stime_to_time(stime) converts a "scene time" to the index time
-    that is displayed at that scene time.
+    that is displayed at that scene time. Scene times can be given either as
+    a single value or as a NumPy array of values.
     
     Attributes
     ----------
@@ -28,21 +47,24 @@ class Timing:
     
     __call__ : get the index time given the scene time
     get_playback_rate : Calculate the playback rate at a given scene time
+    evaluate : get the index times and playback rates at an array of scene times
     update_with_stime : update values with the Scene time
     stime_to_time : convert a scene time to an index time
+    time_to_stime : convert an index time to a scene time
     '''
     
     def __init__(self):      
         self.current_stime = np.nan
         self.current_playback_rate = np.nan
         self.current_indextime = np.nan
+        self._stime_cache = {}
         
-    def stime_to_time(stime):
+    def stime_to_time(self,stime):
         '''
         Function that returns the index time given the scene time. By defualt,
         returns np.nan since it has not been set yet.
         '''
-        return np.nan
+        return _broadcast(np.nan,stime)
         
     def __call__(self,stime):
         '''
@@ -52,28 +74,70 @@ class Timing:
     
     def get_playback_rate(self,stime,d_stime=1e-3):
         '''
-        Numerically calculate the playback rate at a given scene time.
+        Numerically calculate the playback rate at a given scene time. Derived
+        classes override this where the playback rate is known analytically.
         '''
         time_0 = self(stime)
         time_1 = self(stime+d_stime)
         playback_rate = (time_1-time_0)/d_stime
         return playback_rate
     
-    def update_with_stime(self,stime):
+    def evaluate(self,stime):
+        '''Return the index times and playback rates at an array of scene
+        times, computed for the whole array at once where the methods allow
+        it.
+        '''
+        return _call_on_array(self,stime),_call_on_array(self.get_playback_rate,stime)
+        
+    def update_with_stime(self,stime,indextime=None,playback_rate=None):
         '''Update the instance with the scene time (time, in seconds, into the
-        playback of the scene).
+        playback of the scene). The index time and playback rate are computed
+        unless they are given, as when they have been computed ahead of time
+        for every frame of a Video.
         '''
         self.current_stime = stime
-        self.current_indextime = self(stime)
-        self.current_playback_rate = self.get_playback_rate(stime)
+        self.current_indextime = self(stime) if indextime is None else indextime
+        self.current_playback_rate = self.get_playback_rate(stime) if playback_rate is None else playback_rate
         
     def time_to_stime(self,time):
-        '''Compute the scenetime corresponding to an indextime using
-        scipy.optimize.minimize.
+        '''Compute the scenetime corresponding to an indextime. Derived
+        classes override this with the analytic inverse of stime_to_time;
+        otherwise it is found numerically by bisection, assuming the index
+        time changes monotonically through the scene. Results for single
+        index times are cached.
         '''
-        resid = lambda stime: (self(stime)-time)**2
-        res = scipy.optimize.minimize(resid,np.array([0]),bounds=[np.array([0,self.sduration])],tol=(1e-6)**2)
-        return res.x[0]
+        if np.ndim(time) > 0:
+            return self._bisect_stime(time)
+        # 0-d arrays aren't hashable
+        key = float(time)
+        if key not in self._stime_cache:
+            self._stime_cache[key] = self._bisect_stime(key)
+        return self._stime_cache[key]
+    
+    def _bisect_stime(self,time,max_iter=100):
+        '''Vectorized bisection for the scene times at which the given index
+        times are shown, bracketed by the start and end of the scene.
+        '''
+        time = np.asarray(time,dtype=float)
+        lo = np.zeros(time.shape)
+        hi = np.full(time.shape,float(self.sduration))
+        increasing = self(self.sduration) >= self(0)
+        for _ in range(max_iter):
+            mid = (lo+hi)/2
+            if increasing:
+                past = self(mid) >= time
+            else:
+                past = self(mid) <= time
+            hi = np.where(past,mid,hi)
+            lo = np.where(past,lo,mid)
+            if np.all(hi-lo <= 1e-12*max(self.sduration,1)):
+                break
+        return ((lo+hi)/2)[()]
+    
+    def _clip_stime(self,stime):
+        '''Clip scene times to the duration of the scene.
+        '''
+        return np.clip(stime,0,self.sduration)[()]
 
     
 '''
@@ -93,6 +157,10 @@ class LinearPlaybackDefinedSpeed(Timing):
         self.sduration = (self.end_time-self.start_time)/self.playback_speed
     def stime_to_time(self,stime):
         return self.start_time + stime*self.playback_speed
+    def get_playback_rate(self,stime,d_stime=None):
+        return _broadcast(self.playback_speed,stime)
+    def time_to_stime(self,time):
+        return self._clip_stime((np.asarray(time)-self.start_time)/self.playback_speed)
     
 class LinearPlaybackDefinedDuration(Timing):
     '''Linear playback given a range of times and total scene duration.
@@ -104,6 +172,10 @@ class LinearPlaybackDefinedDuration(Timing):
         self.sduration = sduration        
     def stime_to_time(self,stime):
         return self.start_time + (stime/self.sduration)*(self.end_time-self.start_time)
+    def get_playback_rate(self,stime,d_stime=None):
+        return _broadcast((self.end_time-self.start_time)/self.sduration,stime)
+    def time_to_stime(self,time):
+        return self._clip_stime((np.asarray(time)-self.start_time)/(self.end_time-self.start_time)*self.sduration)
     
 class LinearPlaybackDefinedSpeedAndDuration(Timing):
     '''Linear playback given a start time, playback speed, and scene duration.
@@ -117,6 +189,25 @@ class LinearPlaybackDefinedSpeedAndDuration(Timing):
         self.end_time = self.start_time+duration
     def stime_to_time(self,stime):
         return self.start_time + (stime/self.sduration)*(self.end_time-self.start_time)
+    def get_playback_rate(self,stime,d_stime=None):
+        return _broadcast((self.end_time-self.start_time)/self.sduration,stime)
+    def time_to_stime(self,time):
+        return self._clip_stime((np.asarray(time)-self.start_time)/(self.end_time-self.start_time)*self.sduration)
+    
+class PausePlaybackDefinedDuration(Timing):
+    '''Playback paused at a single index time for a given scene duration.
+    '''
+    def __init__(self,time,sduration):
+        super().__init__()
+        self.start_time = time
+        self.end_time = time
+        self.sduration = sduration
+    def stime_to_time(self,stime):
+        return _broadcast(self.start_time,stime)
+    def get_playback_rate(self,stime,d_stime=None):
+        return _broadcast(0,stime)
+    def time_to_stime(self,time):
+        return np.where(np.asarray(time)>self.start_time,float(self.sduration),0.)[()]
     
 #class LogarithmicPlaybackDefinedSpeeds(Timing):
 #    '''Logarithmic playback given the start and end times and 
@@ -142,6 +233,10 @@ class LogarithmicPlaybackDefinedDuration(Timing):
         self.sduration = sduration        
     def stime_to_time(self,stime):
         return 10**(np.log10(self.start_time)+stime/(self.sduration)*(np.log10(self.end_time)-np.log10(self.start_time)))
+    def get_playback_rate(self,stime,d_stime=None):
+        return self(stime)*np.log(10)*(np.log10(self.end_time)-np.log10(self.start_time))/self.sduration
+    def time_to_stime(self,time):
+        return self._clip_stime((np.log10(time)-np.log10(self.start_time))/(np.log10(self.end_time)-np.log10(self.start_time))*self.sduration)
     
 ReversedLogarithmicPlaybackDefinedDuration = LogarithmicPlaybackDefinedDuration
         
@@ -151,21 +246,126 @@ ReversedLogarithmicPlaybackDefinedDuration = LogarithmicPlaybackDefinedDuration
 ###############################################################################
 '''
 
+class CompositeTiming(Timing):
+    '''
+    Several instances of Timing played one after the other, used on a single
+    Scene.
+    
+    The segment containing a scene time is found by a binary search over the
+    scene times at which the segments start, so lookups take O(log n) in the
+    number of segments, and arrays of scene times are evaluated with one call
+    to each segment they fall in. The playback rate is that of the segment
+    containing the scene time. Composites given as segments are flattened into
+    their own segments, so nesting costs nothing. Unlike the closures
+    previously built by combine_timings, instances can be pickled (as long as
+    the segments can), so they can be sent to worker processes.
+    
+    Parameters
+    ----------
+    
+    timings : list of Timing.
+        The timings to play, in order.
+        
+    Attributes
+    ----------
+    
+    timings : list of Timing.
+        The timings as given.
+        
+    segments : list of Timing.
+        The timings played, with composites flattened.
+        
+    segment_start_stimes : np.ndarray.
+        The scene time at which each segment starts.
+    '''
+    
+    def __init__(self,timings):
+        super().__init__()
+        if len(timings) == 0:
+            raise ValueError('timings must not be empty')
+        self.timings = list(timings)
+        self.segments = []
+        for t in self.timings:
+            if isinstance(t,CompositeTiming):
+                self.segments.extend(t.segments)
+            else:
+                self.segments.append(t)
+        segment_durations = np.array([t.sduration for t in self.segments],dtype=float)
+        self.segment_start_stimes = np.concatenate([[0],np.cumsum(segment_durations)[:-1]])
+        self.sduration = float(np.sum(segment_durations))
+        
+        # the range of index times shown in each segment
+        time_0 = np.array([t(0) for t in self.segments],dtype=float)
+        time_1 = np.array([t(t.sduration) for t in self.segments],dtype=float)
+        self._segment_min_times = np.minimum(time_0,time_1)
+        self._segment_max_times = np.maximum(time_0,time_1)
+        # when the index time never goes back, the segment showing an index
+        # time can be found by a binary search too
+        self._monotonic = bool(np.all(time_0<=time_1) and np.all(time_1[:-1]<=time_0[1:]))
+        
+    def _which_segment(self,stime):
+        '''Return the index of the segment containing each scene time; scene
+        times outside the scene go to the first or last segment.
+        '''
+        which = np.searchsorted(self.segment_start_stimes,stime,side='right')-1
+        return np.clip(which,0,len(self.segments)-1)
+        
+    def _piecewise(self,func_name,stime):
+        '''Evaluate a method of each segment on the scene times which fall
+        within it, relative to the start of the segment.
+        '''
+        stime = np.asarray(stime,dtype=float)
+        which = self._which_segment(stime)
+        if stime.ndim == 0:
+            si = int(which)
+            return float(getattr(self.segments[si],func_name)(stime-self.segment_start_stimes[si]))
+        
+        # group the scene times by segment, and evaluate each group at once
+        flat_stime = stime.ravel()
+        flat_which = which.ravel()
+        order = np.argsort(flat_which,kind='stable')
+        present,group_starts = np.unique(flat_which[order],return_index=True)
+        group_ends = np.append(group_starts[1:],len(order))
+        res = np.empty(flat_stime.shape)
+        for si,i0,i1 in zip(present,group_starts,group_ends):
+            ixs = order[i0:i1]
+            res[ixs] = _call_on_array(getattr(self.segments[si],func_name),flat_stime[ixs]-self.segment_start_stimes[si])
+        return res.reshape(stime.shape)
+        
+    def stime_to_time(self,stime):
+        return self._piecewise('stime_to_time',stime)
+    
+    def get_playback_rate(self,stime,d_stime=None):
+        return self._piecewise('get_playback_rate',stime)
+    
+    def time_to_stime(self,time):
+        '''Invert the segments piecewise: each index time is found in the
+        first segment whose range of index times contains it. Index times not
+        shown in the scene go to its nearer end.
+        '''
+        time = np.asarray(time,dtype=float)
+        stime = np.full(time.shape,np.nan)
+        if self._monotonic:
+            which = np.minimum(np.searchsorted(self._segment_max_times,time,side='left'),len(self.segments)-1)
+            found = (time>=self._segment_min_times[which]) & (time<=self._segment_max_times[which])
+            for si in np.unique(which[found]):
+                in_segment = found & (which==si)
+                stime[in_segment] = self.segments[si].time_to_stime(time[in_segment])+self.segment_start_stimes[si]
+        else:
+            for si,t in enumerate(self.segments):
+                in_segment = np.isnan(stime) & (time>=self._segment_min_times[si]) & (time<=self._segment_max_times[si])
+                if np.any(in_segment):
+                    stime[in_segment] = t.time_to_stime(time[in_segment])+self.segment_start_stimes[si]
+        
+        missing = np.isnan(stime)
+        if np.any(missing):
+            nearer_start = np.abs(time[missing]-self(0)) <= np.abs(time[missing]-self(self.sduration))
+            stime[missing] = np.where(nearer_start,0,self.sduration)
+        return stime[()]
+
 def combine_timings(timings_list):
     '''
     Combine a bunch of instances of Timing into one instance that can be used
     on a single Scene.
     '''
-    new_timing = Timing()
-    scene_durations = np.array([t.sduration for t in timings_list])
-    scene_start_times = np.array([0]+list(np.cumsum(scene_durations)))
-    total_sduration = np.sum(scene_durations)
-    new_timing.sduration = total_sduration
-    def stime_to_time(stime):
-        possible_scene_start_times = scene_start_times[scene_start_times<=stime]
-        which_timing = np.argmax(possible_scene_start_times)
-        scene_start_time = possible_scene_start_times[which_timing]
-        return timings_list[which_timing](stime-scene_start_time)
-    new_timing.stime_to_time = stime_to_time
-    
-    return new_timing
\ No newline at end of file
+    return CompositeTiming(timings_list)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Transitions between consecutive Scenes of a Video.
+
+A transition lasts its own duration, between the end of one Scene and the
+start of the next. Its frames aren't drawn: they are blended in NumPy from
+the RGBA pixels of the last frame of the outgoing Scene and the first frame
+of the incoming Scene, so neither Scene's drawing function is called again
+and no fade logic is needed in them.
+"""
+
+import numpy as np
+
+class Transition:
+    '''
+    Base class of the transitions between two Scenes.
+
+    Parameters
+    ----------
+    duration : float.
+        The duration of the transition, in seconds of video time.
+    '''
+
+    def __init__(self,duration):
+        if duration < 0:
+            raise ValueError('duration must not be negative')
+        self.duration = duration
+
+    def blend(self,frame_out,frame_in,progress):
+        '''
+        Return the (height,width,4) uint8 RGBA frame of the transition, given
+        the frames of the outgoing and incoming Scenes and the progress of the
+        transition, from 0 at its start to 1 at its end.
+        '''
+        raise NotImplementedError
+
+class Crossfade(Transition):
+    '''
+    Fade the outgoing Scene into the incoming one.
+    '''
+
+    def blend(self,frame_out,frame_in,progress):
+        # integer weights out of 256, so the blend stays in 16 bit integers
+        weight_in = int(round(progress*256))
+        blended = frame_out.astype(np.uint16)*(256-weight_in)
+        blended += frame_in.astype(np.uint16)*weight_in
+        return (blended >> 8).astype(np.uint8)
+
+class Wipe(Transition):
+    '''
+    Uncover the incoming Scene behind an edge sweeping across the frame.
+
+    Parameters
+    ----------
+    duration : float.
+        The duration of the transition, in seconds of video time.
+
+    direction : str.
+        The direction the edge moves in: 'right', 'left', 'down' or 'up'.
+    '''
+
+    DIRECTIONS = ('right','left','down','up')
+
+    def __init__(self,duration,direction='right'):
+        super().__init__(duration)
+        if direction not in self.DIRECTIONS:
+            raise ValueError('direction must be one of '+', '.join(self.DIRECTIONS)+', got '+repr(direction))
+        self.direction = direction
+
+    def blend(self,frame_out,frame_in,progress):
+        frame = frame_out.copy()
+        height,width = frame.shape[:2]
+        if self.direction in ('right','left'):
+            n = int(round(progress*width))
+            cols = slice(0,n) if self.direction == 'right' else slice(width-n,width)
+            frame[:,cols] = frame_in[:,cols]
+        else:
+            # rows count down from the top of the frame
+            n = int(round(progress*height))
+            rows = slice(0,n) if self.direction == 'down' else slice(height-n,height)
+            frame[rows] = frame_in[rows]
+        return frame
@@ -5,9 +5,41 @@ Created on Mon Nov 11 14:53:45 2019
 @author: Daniel Ruth
 """
 
-import numpy as np
-import matplotlib.animation as manimation
+import os
+import json
 import copy
+import gc
+import contextlib
+import numpy as np
+import matplotlib.image
+import matplotlib.font_manager
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from .writer import FFMpegRawWriter
+from .parallel import iter_frames_parallel, RenderPool
+from .jobs import RenderJob
+from .cache import scene_fingerprint, MemoryFrameCache
+from .profiling import new_frame_stats, Stopwatch, call_hooks, peak_rss, current_rss
+from .images import ImageWriterPool, FrameStackWriter, is_raster_extension
+from .gif import GifWriter, WebPWriter, PaletteQuantizer, build_palette, sample_indices
+from .segments import shard_frames, write_manifest, read_manifest, check_manifests, concat_segments
+
+class FrameRenderError(Exception):
+    '''
+    Raised when drawing a frame fails, identifying the frame by its index,
+    video time, Scene index and index time. The original error is chained as
+    the cause.
+    '''
+    def __init__(self,frame_index,video_time,scene_index,indextime):
+        super().__init__(frame_index,video_time,scene_index,indextime)
+        self.frame_index = frame_index
+        self.video_time = video_time
+        self.scene_index = scene_index
+        self.indextime = indextime
+        
+    def __str__(self):
+        return ('Failed to draw frame '+str(self.frame_index)+' (video time '+str(self.video_time)
+                +', scene '+str(self.scene_index)+', index time '+str(self.indextime)+')')
 
 class Video:
     '''
@@ -16,7 +48,7 @@ class Video:
     playback of the video.
     '''
     
-    def __init__(self,scenes,fig,fps=30):
+    def __init__(self,scenes,fig,fps=30,transitions=None,max_rss=None):
         '''
         Parameters
         ----------
@@ -31,11 +63,34 @@ class Video:
             The number of frames per second with which to create the video.
             This parameter only controls the temporal resolution of the
             resulting video file, not its duration or the content shown.
+            
+        transitions : list, or None.
+            For each pair of consecutive Scenes, a Transition (such as a
+            Crossfade or Wipe) played between them, or None to cut straight
+            from one to the next (see the transitions module).
+            
+        max_rss : int, or None.
+            A memory budget, in bytes, for each process drawing frames. When
+            the resident memory goes over it, the Figure (and its canvas) is
+            replaced by a new one before the next frame is drawn, dropping
+            whatever the drawing functions left behind on it and the
+            caches tied to it. The Figure is then set up again for the
+            current Scene. self.fig is the new Figure from then on.
         '''
         
         self.scenes = scenes
         self.fig = fig
         self.fps = fps
+        if transitions is None:
+            transitions = [None]*(len(scenes)-1)
+        if len(transitions) != len(scenes)-1:
+            raise ValueError('Expected '+str(len(scenes)-1)+' transitions, one between each pair of scenes, got '+str(len(transitions)))
+        self.transitions = list(transitions)
+        self.max_rss = max_rss
+        self._rss_after_recycle = 0
+        # frames handed out by .frame and .frames
+        self.frame_lru = MemoryFrameCache()
+        self._active_scene = None
         self._process_times()
         
     def _process_times(self):
@@ -43,58 +98,754 @@ class Video:
         well as the total video duration and the video times of each frame.
         '''
         
-        # get the duration of each scene and the start videotimes for each scene
+        # get the duration of each scene and of each transition after it, and
+        # the start videotimes for each scene
         self.scene_durations = np.array([s.timing.sduration for s in self.scenes])
-        self.scene_start_times = np.array([0]+list(np.cumsum(self.scene_durations))[:-1])
+        self.transition_durations = np.array([0. if t is None else t.duration for t in self.transitions]+[0.])
+        self.scene_start_times = np.array([0]+list(np.cumsum(self.scene_durations+self.transition_durations))[:-1])
         
         # the total duration of the video
-        self.duration = np.sum(self.scene_durations)
+        self.duration = np.sum(self.scene_durations)+np.sum(self.transition_durations)
         
         # calculate the video times
         dt = 1./self.fps
-        self.video_times = np.arange(0,self.duration,dt)
+        self._set_video_times(np.arange(0,self.duration,dt))
+        
+    def _set_video_times(self,video_times):
+        '''Set the video times of the frames, and compute the frame table:
+        the scene, scene time, index time and playback rate of every frame.
+        '''
+        self.video_times = video_times
+        (self.frame_scene_ixs,self.frame_stimes,self.frame_indextimes,
+         self.frame_playback_rates,self.frame_transition_ixs,
+         self.frame_transition_progress) = self._frame_table(self.video_times)
+        
+        # the frames either side of each transition, which its frames are
+        # blended from
+        self.transition_end_frames = np.full((len(self.transitions),2),-1)
+        for ti in np.unique(self.frame_transition_ixs[self.frame_transition_ixs>=0]):
+            transition_frames = np.flatnonzero(self.frame_transition_ixs==ti)
+            fi_out,fi_in = transition_frames[0]-1,transition_frames[-1]+1
+            if fi_out < 0 or fi_in >= len(video_times) or self.frame_transition_ixs[fi_out] >= 0 or self.frame_transition_ixs[fi_in] >= 0:
+                raise ValueError('Transition '+str(ti)+' needs a frame of a scene on either side of it')
+            self.transition_end_frames[ti] = fi_out,fi_in
+        
+    def _frame_table(self,video_times):
+        '''Compute the scene index, scene time, index time, and playback rate
+        for each of an array of video times, and for the frames falling in a
+        transition after a scene, the index of the transition (or -1) and how
+        far through it the frame is (from 0 to 1). The scene times of the
+        transition frames are those of the end of the scene.
+        '''
+        scene_ixs = np.clip(np.searchsorted(self.scene_start_times,video_times,side='right')-1,0,len(self.scenes)-1)
+        stimes = video_times-self.scene_start_times[scene_ixs]
+        in_transition = (stimes >= self.scene_durations[scene_ixs]) & (self.transition_durations[scene_ixs] > 0)
+        transition_ixs = np.where(in_transition,scene_ixs,-1)
+        transition_progress = np.where(in_transition,(stimes-self.scene_durations[scene_ixs])/np.where(in_transition,self.transition_durations[scene_ixs],1),0.)
+        stimes = np.minimum(stimes,self.scene_durations[scene_ixs])
+        indextimes = np.empty(len(video_times))
+        playback_rates = np.empty(len(video_times))
+        
+        # the video times are sorted, so the frames of each scene are contiguous
+        bounds = np.searchsorted(scene_ixs,np.arange(len(self.scenes)+1))
+        for si,scene in enumerate(self.scenes):
+            frames = slice(bounds[si],bounds[si+1])
+            if bounds[si+1] > bounds[si]:
+                indextimes[frames],playback_rates[frames] = scene.timing.evaluate(stimes[frames])
+        return scene_ixs,stimes,indextimes,playback_rates,transition_ixs,transition_progress
         
     def _scene_and_stime(self,vtime):
         '''Given a video time, return the corresponding Scene and the scene
         time within that Scene.
         '''
-        possible_scene_start_times = self.scene_start_times[self.scene_start_times<=vtime]
-        scene_ix = np.argmax(possible_scene_start_times)
+        scene_ix = max(np.searchsorted(self.scene_start_times,vtime,side='right')-1,0)
         scene = self.scenes[scene_ix]
-        stime = vtime-possible_scene_start_times[scene_ix]
+        # during a transition, the end of the scene
+        stime = min(vtime-self.scene_start_times[scene_ix],self.scene_durations[scene_ix])
         return scene,stime
     
+    def _activate(self,scene):
+        '''Prepare the figure for a Scene if it isn't the one drawn last.
+        '''
+        if scene is not self._active_scene:
+            scene.activate(self.fig)
+            self._active_scene = scene
+    
     def __call__(self,video_time):
         '''Create the frame at a given video time on the figure.
         '''
         scene,stime = self._scene_and_stime(video_time)
+        self._activate(scene)
         scene.draw_at_stime(stime,self.fig)
         
-    def write_video(self,fpath_video,metadata_dict=None,**writer_kwargs):
+    def _frame_index(self,key):
+        '''Return the index of a frame given either its index (an int) or
+        a video time (a float), which selects the frame on screen at that
+        time.
+        '''
+        if isinstance(key,(int,np.integer)):
+            if not -len(self.video_times) <= key < len(self.video_times):
+                raise IndexError('Frame index '+str(key)+' out of range for '+str(len(self.video_times))+' frames')
+            return int(key)%len(self.video_times)
+        if not 0 <= key <= self.duration:
+            raise ValueError('Video time '+str(key)+' is outside the video, which lasts '+str(self.duration))
+        return max(int(np.searchsorted(self.video_times,key,side='right'))-1,0)
+        
+    def frame(self,key,**kwargs):
+        '''Return a frame as a read-only (height,width,4) uint8 RGBA array.
+        
+        Parameters
+        ----------
+        key : int or float.
+            The index of the frame, or a video time, which selects the frame
+            shown at that time.
+            
+        **kwargs
+            Passed to frames.
+        '''
+        return self.frames([key],**kwargs)[0]
+        
+    def frames(self,keys,workers=None,chunksize=4,cache=None):
+        '''Return a list of frames as read-only (height,width,4) uint8 RGBA
+        arrays. Frames are kept in memory in self.frame_lru, a
+        MemoryFrameCache, so frames requested again aren't drawn again; call
+        self.frame_lru.clear() after changing what the Scenes draw. The
+        missing frames are drawn in order, so consecutive frames of a Scene
+        reuse its state.
+        
+        Parameters
+        ----------
+        keys : list of int or float.
+            The frame indices or video times (see frame).
+            
+        workers, chunksize, cache
+            As in write_video, for the frames which have to be drawn.
+        '''
+        frame_indices = [self._frame_index(key) for key in keys]
+        frames = {fi:self.frame_lru.get(fi) for fi in frame_indices}
+        missing = sorted(fi for fi,frame in frames.items() if frame is None)
+        if missing:
+            drawn = self._iter_frames(missing,workers=workers,chunksize=chunksize,cache=cache)
+            for fi,(frame,_) in zip(missing,drawn):
+                frame = frame.copy()
+                frames[fi] = frame
+                self.frame_lru.put(fi,frame)
+        return [frames[fi] for fi in frame_indices]
+        
+    def _draw_frame(self,fi,frame_stats=None):
+        '''Draw the frame with index fi (into self.video_times) on the figure,
+        using the precomputed frame table. The time spent is added to
+        frame_stats, which is returned.
+        '''
+        if frame_stats is None:
+            frame_stats = new_frame_stats()
+        scene = self.scenes[self.frame_scene_ixs[fi]]
+        with Stopwatch(frame_stats,'timing'):
+            scene.timing.update_with_stime(self.frame_stimes[fi],
+                                           indextime=self.frame_indextimes[fi],
+                                           playback_rate=self.frame_playback_rates[fi])
+        with Stopwatch(frame_stats,'draw'):
+            self._activate(scene)
+            scene(scene.timing.current_indextime,self.fig)
+        return frame_stats
+        
+    def _render_frame(self,fi):
+        '''Draw the frame with index fi and return its RGBA pixels, as a view
+        of the canvas buffer which is only valid until the next frame is drawn,
+        along with the stats of the frame.
+        '''
+        frame_stats = new_frame_stats()
+        if self.max_rss is not None and self._over_memory_budget():
+            self._recycle_figure()
+            frame_stats['recycled'] = True
+        try:
+            self._draw_frame(fi,frame_stats)
+            with Stopwatch(frame_stats,'rasterize'):
+                frame = self._active_scene.rasterize(self.fig)
+        except Exception as e:
+            raise FrameRenderError(int(fi),float(self.video_times[fi]),int(self.frame_scene_ixs[fi]),
+                                   float(self.frame_indextimes[fi])) from e
+        frame_stats['peak_rss'] = peak_rss()
+        frame_stats['rss'] = current_rss()
+        frame_stats['pid'] = os.getpid()
+        return frame,frame_stats
+    
+    def _over_memory_budget(self):
+        '''Whether the process is over max_rss, and has grown by a tenth of
+        max_rss since the Figure was last recycled (so a process which can't
+        get back under the budget doesn't recycle on every frame).
+        '''
+        rss = current_rss()
+        return rss is not None and rss > self.max_rss and rss > self._rss_after_recycle+0.1*self.max_rss
+    
+    def _recycle_figure(self):
+        '''Replace self.fig with a new Figure of the same size, dpi and
+        facecolor on a new Agg canvas, let the Scenes drop their state tied
+        to the old one, and release the memory.
+        '''
+        old_fig = self.fig
+        self.fig = Figure(figsize=old_fig.get_size_inches(),dpi=old_fig.dpi,facecolor=old_fig.get_facecolor())
+        FigureCanvasAgg(self.fig)
+        for scene in self.scenes:
+            scene.release()
+        self._active_scene = None
+        
+        # empty the old figure, which the caller may still hold
+        old_fig.clf()
+        if hasattr(matplotlib.font_manager,'_get_font'):
+            matplotlib.font_manager._get_font.cache_clear()
+        gc.collect()
+        self._rss_after_recycle = current_rss() or 0
+    
+    def _frame_info(self,fi):
+        '''Describe frame fi for the hooks (see the profiling module).
+        '''
+        return {'frame':int(fi),'n_frames':len(self.video_times),
+                'transition':bool(self.frame_transition_ixs[fi] >= 0),
+                'scene':int(self.frame_scene_ixs[fi]),
+                'video_time':float(self.video_times[fi]),
+                'indextime':float(self.frame_indextimes[fi])}
+        
+    def _iter_frames(self,frame_indices=None,workers=None,chunksize=4,cache=None):
+        '''Yield the RGBA pixels of each frame, as (height,width,4) uint8
+        arrays, along with the stats of each frame. When drawing on self.fig,
+        each array is a view of the canvas buffer which is only valid until
+        the next frame is drawn. Frames found in the FrameCache cache are read
+        from it instead of being drawn, and the ones drawn are added to it.
+        The frames of transitions are blended from the frames either side of
+        them, which are drawn even if they aren't among frame_indices.
+        '''
+        if frame_indices is None:
+            frame_indices = np.arange(len(self.video_times))
+        frame_indices = np.asarray(frame_indices)
+        transition_ixs = self.frame_transition_ixs[frame_indices]
+        if not np.any(transition_ixs >= 0):
+            for frame,frame_stats in self._iter_scene_frames(frame_indices,workers,chunksize,cache):
+                yield frame,frame_stats
+            return
+        
+        end_frames = self.transition_end_frames[np.unique(transition_ixs[transition_ixs>=0])].ravel()
+        scene_indices = np.union1d(frame_indices[transition_ixs<0],end_frames)
+        rendered = zip(scene_indices,self._iter_scene_frames(scene_indices,workers,chunksize,cache))
+        
+        # copies of the frames either side of the transitions, and of frames
+        # drawn ahead of their turn to get the end of a transition
+        end_frames = set(end_frames.tolist())
+        end_pixels = {}
+        held = {}
+        def render_until(fi):
+            for rfi,(frame,frame_stats) in rendered:
+                if rfi in end_frames:
+                    end_pixels[rfi] = frame.copy()
+                if rfi == fi:
+                    return frame,frame_stats
+                held[rfi] = (end_pixels[rfi],frame_stats)
+        
+        for fi,ti in zip(frame_indices,transition_ixs):
+            if ti < 0:
+                yield held.pop(fi) if fi in held else render_until(fi)
+                continue
+            fi_out,fi_in = self.transition_end_frames[ti]
+            for end_fi in (fi_out,fi_in):
+                if end_fi not in end_pixels:
+                    # the frame after the transition is yielded in its turn
+                    frame_stats = render_until(end_fi)[1]
+                    held[end_fi] = (end_pixels[end_fi],frame_stats)
+            # forget the ends of earlier transitions
+            for end_fi in [k for k in end_pixels if k < fi_out]:
+                del end_pixels[end_fi]
+            frame_stats = new_frame_stats()
+            with Stopwatch(frame_stats,'rasterize'):
+                frame = self.transitions[ti].blend(end_pixels[fi_out],end_pixels[fi_in],self.frame_transition_progress[fi])
+            yield frame,frame_stats
+            
+    def _iter_scene_frames(self,frame_indices,workers,chunksize,cache):
+        '''Yield the pixels and stats of frames of the Scenes (not of
+        transitions), from the FrameCache cache if given.
+        '''
+        if cache is None:
+            for frame,frame_stats in self._iter_rendered_frames(frame_indices,workers,chunksize):
+                yield frame,frame_stats
+            return
+        
+        # find which frames have to be drawn
+        fingerprints = [scene_fingerprint(scene) for scene in self.scenes]
+        keys = [cache.frame_key(fingerprints[self.frame_scene_ixs[fi]],self.frame_stimes[fi],
+                                self.frame_indextimes[fi],self.frame_playback_rates[fi],self.fig)
+                for fi in frame_indices]
+        # the frames found are marked as used, so the frames drawn now don't
+        # evict them before they are read
+        missing = np.array([not cache.touch(key) for key in keys],dtype=bool)
+        rendered = self._iter_rendered_frames(np.asarray(frame_indices)[missing],workers,chunksize)
+        
+        for fi,key,is_missing in zip(frame_indices,keys,missing):
+            if is_missing:
+                frame,frame_stats = next(rendered)
+                cache.put(key,frame)
+                yield frame,frame_stats
+                continue
+            frame_stats = new_frame_stats(cached=True)
+            with Stopwatch(frame_stats,'rasterize'):
+                frame = cache.get(key)
+            if frame is None:
+                # evicted since it was looked up
+                frame,frame_stats = self._render_frame(fi)
+                cache.put(key,frame)
+            yield frame,frame_stats
+            
+    def _iter_rendered_frames(self,frame_indices,workers,chunksize):
+        '''Draw the frames, either on self.fig or in a process pool.
+        '''
+            
+        # render the frames in a shared pool, or in a process pool of their own
+        if isinstance(workers,RenderPool):
+            for frame,frame_stats in workers.iter_frames(self,frame_indices,chunksize=chunksize):
+                yield frame,frame_stats
+            return
+        if workers is not None and workers > 1:
+            for frame,frame_stats in iter_frames_parallel(self,frame_indices,workers,chunksize=chunksize):
+                yield frame,frame_stats
+            return
+        
+        # draw each frame on the figure
+        for frame,frame_stats in self._iter_drawn_frames(frame_indices):
+            yield frame,frame_stats
+            
+    def _repeats_frame(self,prev_fi,fi):
+        '''Whether frame fi is identical to frame prev_fi, since they show the
+        same index time of a static Scene.
+        '''
+        return (prev_fi is not None
+                and self.frame_scene_ixs[fi] == self.frame_scene_ixs[prev_fi]
+                and self.scenes[self.frame_scene_ixs[fi]].static
+                and self.frame_indextimes[fi] == self.frame_indextimes[prev_fi])
+            
+    def _iter_drawn_frames(self,frame_indices):
+        '''Draw each frame on self.fig and yield its pixels and stats. A frame
+        which repeats the previous one isn't drawn again: the same array,
+        holding the previous frame, is yielded again. That array is a copy of
+        the canvas buffer, since the caller may draw on self.fig in between
+        (as when a cached frame has gone missing).
+        '''
+        prev_fi = None
+        for i,fi in enumerate(frame_indices):
+            if self._repeats_frame(prev_fi,fi):
+                frame_stats = new_frame_stats(repeated=True)
+            else:
+                frame,frame_stats = self._render_frame(fi)
+                if i+1 < len(frame_indices) and self._repeats_frame(fi,frame_indices[i+1]):
+                    frame = frame.copy()
+            prev_fi = fi
+            yield frame,frame_stats
+        
+    def write_video(self,fpath_video,metadata_dict=None,workers=None,chunksize=4,cache=None,hooks=None,**writer_kwargs):
         '''Write the video to a single video file.
+        
+        Parameters
+        ----------
+        fpath_video : str.
+            The path of the video file to write.
+            
+        metadata_dict : dict, or None.
+            Metadata to include in the video file.
+            
+        workers : int, RenderPool, or None.
+            If greater than 1, the frames are rendered across this many worker
+            processes (see the parallel module) instead of on self.fig. A
+            RenderPool renders them in its long-lived pool, shared with other
+            Videos.
+            
+        chunksize : int.
+            The number of consecutive frames handed to a worker at once, when
+            workers is greater than 1.
+            
+        cache : FrameCache, or None.
+            If given, frames of unchanged Scenes are read from this cache
+            instead of being drawn, and newly drawn frames are added to it.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame once it is written, such as a
+            ProgressPrinter or RenderProfiler (see the profiling module).
+            
+        **writer_kwargs
+            Passed to FFMpegRawWriter, such as codec, bitrate, extra_args, or
+            queue_size.
+        '''
+        self._write_frames(fpath_video,np.arange(len(self.video_times)),metadata_dict,
+                           workers,chunksize,cache,hooks,**writer_kwargs)
+        
+    def _write_frames(self,fpath_video,frame_indices,metadata_dict=None,workers=None,chunksize=4,cache=None,hooks=None,**writer_kwargs):
+        '''Write the given frames to a video file.
         '''
         if metadata_dict is None:
             metadata_dict = {}
         
-        # create the writer for the video file
-        FFMpegWriter = copy.deepcopy(manimation.writers['ffmpeg'])
-        writer = copy.deepcopy(FFMpegWriter(fps=self.fps, metadata=metadata_dict, **writer_kwargs))
-        with writer.saving(self.fig, fpath_video, dpi=self.fig.dpi):
-            print(writer.codec)
-            #for video_time in tqdm(self.video_times,desc='writing the video file'):
-            for vti,video_time in enumerate(self.video_times):
-                print('Writing frame '+str(vti)+'/'+str(len(self.video_times))+'...')
-                self(video_time)
-                writer.grab_frame()
+        frames = self._iter_frames(frame_indices,workers=workers,chunksize=chunksize,cache=cache)
+        with FFMpegRawWriter(fpath_video,self.fps,metadata=metadata_dict,**writer_kwargs) as writer:
+            for fi,(frame,frame_stats) in zip(frame_indices,frames):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(frame)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
                 
-#    def write_gif(self,fpath_gif):
-#        '''Requires imagemagick, which isn't installed yet'''
-#        
-#        writer = manimation.ImageMagickWriter(fps=self.fps)
-#        with writer.saving(self.fig, fpath_gif, self.fig.get_dpi()):
-#            for video_time in tqdm(self.video_times,desc='writing the GIF'):
-#                self(video_time)
-#                writer.grab_frame()
+    def submit(self,fpath,method='write_video',executor=None,**kwargs):
+        '''Start writing the video in the background, returning a RenderJob
+        which reports its progress, can cancel it, and holds its result (and
+        can be awaited in asyncio). The frames are drawn on self.fig, so
+        Videos running at the same time need Figures of their own, or can
+        share a RenderPool passed as workers.
+        
+        Parameters
+        ----------
+        fpath : str.
+            The path written, passed to the method.
+            
+        method : str.
+            The writing method to run, such as 'write_video',
+            'write_frame_stack' or 'write_images'.
+            
+        executor : concurrent.futures.Executor, or None.
+            A thread pool to run the job in. By default, the job runs in a
+            thread of its own.
+            
+        **kwargs
+            Passed to the method, such as workers (an int or RenderPool) or
+            hooks.
+        '''
+        return RenderJob(self,fpath,method=method,executor=executor,**kwargs)
+        
+    def write_outputs(self,sinks,workers=None,chunksize=4,cache=None,hooks=None):
+        '''Write several outputs from a single render of the video: each
+        frame is drawn once and handed to every sink which wants it.
+        
+        Parameters
+        ----------
+        sinks : list.
+            The outputs, such as VideoSink and ImageSink instances (see the
+            sinks module), each with its own frames, scale, codec and bitrate.
+            
+        workers, chunksize, cache, hooks
+            As in write_video. The encode time of a frame covers all sinks.
+        '''
+        for sink in sinks:
+            sink.open(self)
+        
+        # only draw the frames some sink wants
+        frame_indices = np.flatnonzero(np.any([sink.mask for sink in sinks],axis=0))
+        with contextlib.ExitStack() as stack:
+            for sink in sinks:
+                stack.enter_context(sink)
+            frames = self._iter_frames(frame_indices,workers=workers,chunksize=chunksize,cache=cache)
+            for fi,(frame,frame_stats) in zip(frame_indices,frames):
+                with Stopwatch(frame_stats,'encode'):
+                    for sink in sinks:
+                        sink.write(fi,frame)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
+                
+    def preview(self,fpath,fps=10,scale=0.5,keyframes=None,contact_sheet=False,ncols=None,hooks=None,**kwargs):
+        '''Quickly write a low-quality version of the video to check it. The
+        frames are drawn with the same Scenes and Timings as the full video,
+        but at a reduced dpi and fewer frames per second (or only a few
+        keyframes per Scene), and encoded with a fast preset or tiled into a
+        single contact sheet image.
+        
+        Parameters
+        ----------
+        fpath : str.
+            The path of the video file, or of the image if contact_sheet.
+            
+        fps : float.
+            The frames per second of the preview. With keyframes, the rate at
+            which the keyframes are shown in the preview video.
+            
+        scale : float.
+            The factor by which the dpi of the figure is scaled.
+            
+        keyframes : int, or None.
+            If given, only draw this many frames for each Scene, evenly spread
+            through it, instead of frames at fps.
+            
+        contact_sheet : bool.
+            Whether to tile the frames into a single image instead of writing
+            a video.
+            
+        ncols : int, or None.
+            The number of columns of the contact sheet. Defaults to the number
+            of keyframes, or else to a roughly square grid.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame (see write_video).
+            
+        **kwargs
+            Passed on as in write_video (or, for a contact sheet, workers,
+            chunksize and cache).
+        '''
+        preview = copy.copy(self)
+        preview._active_scene = None
+        preview.fps = fps
+        if keyframes is None:
+            preview._process_times()
+        else:
+            # the middle of keyframes equal spans of each scene
+            offsets = (np.arange(keyframes)+0.5)/keyframes
+            preview._set_video_times(np.concatenate([start+offsets*duration for start,duration
+                                                     in zip(self.scene_start_times,self.scene_durations) if duration > 0]))
+        
+        dpi = self.fig.dpi
+        self.fig.set_dpi(dpi*scale)
+        try:
+            if contact_sheet:
+                if ncols is None:
+                    ncols = keyframes if keyframes is not None else int(np.ceil(np.sqrt(len(preview.video_times))))
+                preview._write_contact_sheet(fpath,ncols,hooks=hooks,**kwargs)
+            else:
+                kwargs.setdefault('extra_args',['-preset','ultrafast'])
+                preview.write_video(fpath,hooks=hooks,**kwargs)
+        finally:
+            self.fig.set_dpi(dpi)
+            # make each scene set itself up again at the original dpi
+            self._active_scene = None
+            
+    def _write_contact_sheet(self,fpath,ncols,hooks=None,**kwargs):
+        '''Tile every frame into a grid of ncols columns and save it as an
+        image.
+        '''
+        sheet = None
+        for fi,(frame,frame_stats) in enumerate(self._iter_frames(**kwargs)):
+            if sheet is None:
+                h,w = frame.shape[:2]
+                nrows = int(np.ceil(len(self.video_times)/ncols))
+                sheet = np.full((nrows*h,ncols*w,4),255,dtype=np.uint8)
+            with Stopwatch(frame_stats,'encode'):
+                row,col = divmod(fi,ncols)
+                sheet[row*h:(row+1)*h,col*w:(col+1)*w] = frame
+            frame_stats.update(self._frame_info(fi))
+            call_hooks(hooks,frame_stats)
+        matplotlib.image.imsave(fpath,sheet)
+        
+    def write_video_resumable(self,fpath_video,segment_frames=1800,dir_segments=None,keep_segments=False,**kwargs):
+        '''Write the video to a single video file by way of separately
+        encoded segments of segment_frames frames each. A checkpoint records
+        the finished segments, so if the render is interrupted or a frame
+        fails to draw, calling this again skips the segments already written.
+        
+        Parameters
+        ----------
+        fpath_video : str.
+            The path of the video file to write.
+            
+        segment_frames : int.
+            The number of frames in each segment.
+            
+        dir_segments : str, or None.
+            The directory for the segments and the checkpoint. Defaults to
+            fpath_video with '_segments' appended.
+            
+        keep_segments : bool.
+            Whether to keep the segments once they have been joined.
+            
+        **kwargs
+            Passed on as in write_video.
+        '''
+        if dir_segments is None:
+            dir_segments = fpath_video+'_segments'
+        os.makedirs(dir_segments,exist_ok=True)
+        fpath_checkpoint = os.path.join(dir_segments,'checkpoint.json')
+        ext = os.path.splitext(fpath_video)[1]
+        
+        # the layout of the segments; a checkpoint for another layout is ignored
+        n_frames = len(self.video_times)
+        layout = {'fps':self.fps,'n_video_frames':n_frames,'segment_frames':segment_frames}
+        checkpoint = {'layout':layout,'finished':[]}
+        if os.path.exists(fpath_checkpoint):
+            with open(fpath_checkpoint) as f:
+                saved = json.load(f)
+            if saved['layout'] == layout:
+                checkpoint = saved
+        
+        fpath_segments = []
+        for si,first_frame in enumerate(range(0,n_frames,segment_frames)):
+            fpath_segment = os.path.join(dir_segments,'segment_'+str(si).zfill(6)+ext)
+            fpath_segments.append(fpath_segment)
+            if si in checkpoint['finished'] and os.path.exists(fpath_segment) and read_manifest(fpath_segment) is not None:
+                continue
+            
+            # write the segment under a temporary name, so an interrupted
+            # segment is never taken for a finished one
+            frame_indices = np.arange(first_frame,min(first_frame+segment_frames,n_frames))
+            fpath_partial = os.path.join(dir_segments,'partial_'+str(si).zfill(6)+ext)
+            try:
+                self._write_frames(fpath_partial,frame_indices,**kwargs)
+            except BaseException:
+                if os.path.exists(fpath_partial):
+                    os.remove(fpath_partial)
+                raise
+            os.replace(fpath_partial,fpath_segment)
+            write_manifest(fpath_segment,self,frame_indices)
+            
+            # record the progress
+            checkpoint['finished'].append(si)
+            with open(fpath_checkpoint+'.tmp','w') as f:
+                json.dump(checkpoint,f)
+            os.replace(fpath_checkpoint+'.tmp',fpath_checkpoint)
+            
+        self.merge_shards(fpath_segments,fpath_video)
+        if not keep_segments:
+            for fpath_segment in fpath_segments:
+                os.remove(fpath_segment)
+                os.remove(fpath_segment+'.json')
+            os.remove(fpath_checkpoint)
+            os.rmdir(dir_segments)
+        
+    def write_shard(self,fpath_segment,shard,n_shards,**kwargs):
+        '''Write one shard of the video, a contiguous range of its frames,
+        to its own video file, along with a manifest describing it. The
+        shards can be written on separate machines and then joined with
+        merge_shards.
+        
+        Parameters
+        ----------
+        fpath_segment : str.
+            The path of the video file to write for this shard. The manifest
+            is written to the same path with '.json' appended.
+            
+        shard : int.
+            Which shard to write, from 0 to n_shards-1.
+            
+        n_shards : int.
+            The number of shards the video is split into, at most the number
+            of frames.
+            
+        **kwargs
+            Passed on as in write_video.
+        '''
+        frame_indices = shard_frames(len(self.video_times),shard,n_shards)
+        self._write_frames(fpath_segment,frame_indices,**kwargs)
+        write_manifest(fpath_segment,self,frame_indices)
+        
+    def merge_shards(self,fpath_segments,fpath_video):
+        '''Check that the shards written with write_shard hold every frame
+        of the video, then join them into a single video file without
+        re-encoding them.
+        
+        Parameters
+        ----------
+        fpath_segments : list of str.
+            The paths of the video files of the shards, in any order.
+            
+        fpath_video : str.
+            The path of the video file to write.
+        '''
+        manifests = []
+        for fpath_segment in fpath_segments:
+            manifest = read_manifest(fpath_segment)
+            if manifest is None:
+                raise ValueError('No manifest found for segment '+fpath_segment)
+            manifests.append(manifest)
+        manifests = check_manifests(manifests,self)
+        concat_segments([m['segment'] for m in manifests],fpath_video)
+                
+    def _palette_quantizers(self,palette,n_colors,dither,n_samples,**kwargs):
+        '''Build the PaletteQuantizer of each frame for write_gif, from
+        palettes of up to n_colors colors built from n_samples frames of the
+        whole video (palette='global'), or of each Scene and each transition
+        (palette='scene').
+        '''
+        if palette not in ('global','scene'):
+            raise ValueError("palette must be 'global' or 'scene', got "+repr(palette))
+        if palette == 'global':
+            groups = np.zeros(len(self.video_times),dtype=int)
+        else:
+            # transitions mix the colors of both scenes, so get their own
+            groups = np.where(self.frame_transition_ixs>=0,len(self.scenes)+self.frame_transition_ixs,self.frame_scene_ixs)
+        group_frames = {g:np.flatnonzero(groups==g) for g in np.unique(groups)}
+        sample_ixs = np.unique(np.concatenate([frames[sample_indices(len(frames),n_samples)] for frames in group_frames.values()]))
+        samples = {g:[] for g in group_frames}
+        for fi,(frame,frame_stats) in zip(sample_ixs,self._iter_frames(sample_ixs,**kwargs)):
+            samples[groups[fi]].append(frame.copy())
+        quantizers = {g:PaletteQuantizer(build_palette(samples[g],n_colors),dither=dither) for g in group_frames}
+        return [quantizers[g] for g in groups]
+        
+    def write_gif(self,fpath_gif,palette='global',n_colors=256,dither=False,n_samples=16,loop=0,hooks=None,**kwargs):
+        '''Save the video as an animated GIF, without any external tool
+        (see the gif module).
+        
+        The colors are reduced to a palette built from a sample of the
+        frames, which are drawn an extra time for it. Only the part of each
+        frame which changed is encoded, and repeated frames are merged into a
+        longer one, so static stretches cost next to nothing. GIF frame times
+        are whole hundredths of a second.
+        
+        Parameters
+        ----------
+        fpath_gif : str.
+            The path of the GIF file to write.
+            
+        palette : str.
+            'global' for a single palette for the whole video, or 'scene' for
+            a palette for each Scene (and each transition), written as local
+            color tables, which suits Scenes with very different colors.
+            
+        n_colors : int.
+            The number of colors of each palette, at most 256.
+            
+        dither : bool.
+            Whether to apply ordered dithering, which smooths gradients.
+            
+        n_samples : int.
+            The number of frames (of the video, or of each Scene) the
+            palettes are built from.
+            
+        loop : int, or None.
+            The number of times to play the GIF, 0 to loop forever, or None to
+            play it once.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame (see write_video).
+            
+        **kwargs
+            workers, chunksize and cache, as in write_video.
+        '''
+        quantizers = self._palette_quantizers(palette,n_colors,dither,n_samples,**kwargs)
+        with GifWriter(fpath_gif,self.fps,loop=loop) as writer:
+            for fi,(frame,frame_stats) in enumerate(self._iter_frames(**kwargs)):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(quantizers[fi].quantize(frame),quantizers[fi].palette)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
+                
+    def write_webp(self,fpath_webp,quality=80,lossless=False,loop=0,hooks=None,**kwargs):
+        '''Save the video as an animated WebP file with Pillow, in full
+        color. The frames are held in memory until they are encoded at the
+        end (repeated frames only once), so this suits short clips.
+        
+        Parameters
+        ----------
+        fpath_webp : str.
+            The path of the WebP file to write.
+            
+        quality : int.
+            The quality of lossy encoding, from 0 to 100.
+            
+        lossless : bool.
+            Whether to encode the frames losslessly.
+            
+        loop : int.
+            The number of times to play the animation, 0 to loop forever.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame (see write_video).
+            
+        **kwargs
+            workers, chunksize and cache, as in write_video.
+        '''
+        with WebPWriter(fpath_webp,self.fps,loop=loop,lossless=lossless,quality=quality) as writer:
+            for fi,(frame,frame_stats) in enumerate(self._iter_frames(**kwargs)):
+                with Stopwatch(frame_stats,'encode'):
+                    writer.write(frame)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
                 
 #    def write_html(self,fpath_video,metadata_dict=None):
 #        '''Write the video to a single html file, does not work.
@@ -110,12 +861,77 @@ class Video:
 #                self(video_time)
 #                writer.grab_frame()        
         
-    def write_images(self,directory,extension='.png'):
+    def write_images(self,directory,extension='.png',hooks=None,io_threads=4,**kwargs):
         '''Save each frame as an image in a directory.
+        
+        Raster images (such as .png or .jpg) are written from the rendered
+        pixels by io_threads threads, so they are compressed while the next
+        frames are drawn; other formats (such as .pdf) are saved from the
+        figure with savefig, one at a time.
+        
+        Parameters
+        ----------
+        directory : str.
+            The directory (including the trailing separator) to write to.
+            
+        extension : str.
+            The extension, and so format, of the images.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame (see write_video).
+            
+        io_threads : int.
+            The number of threads writing raster images.
+            
+        **kwargs
+            workers, chunksize and cache, as in write_video, for raster
+            images.
         '''
-        print('Writing the images')
         n_digits = len(str(int(len(self.video_times))))
-        #for fi,video_time in tqdm(enumerate(self.video_times),desc='writing the frames'):
-        for fi,video_time in enumerate(self.video_times):
-            self(video_time)
-            self.fig.savefig(directory+'frame_'+str(fi).zfill(n_digits)+extension)
+        fpaths = [directory+'frame_'+str(fi).zfill(n_digits)+extension for fi in range(len(self.video_times))]
+        
+        # vector formats have to be saved from the figure, so transitions
+        # can't be blended: their frames show the nearer scene
+        if not is_raster_extension(extension):
+            for fi in range(len(self.video_times)):
+                ti = self.frame_transition_ixs[fi]
+                if ti >= 0:
+                    frame_stats = self._draw_frame(self.transition_end_frames[ti][int(self.frame_transition_progress[fi] >= 0.5)])
+                else:
+                    frame_stats = self._draw_frame(fi)
+                with Stopwatch(frame_stats,'encode'):
+                    self.fig.savefig(fpaths[fi])
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
+            return
+        
+        with ImageWriterPool(io_threads,dpi=self.fig.dpi) as image_writer:
+            for fi,(frame,frame_stats) in enumerate(self._iter_frames(**kwargs)):
+                with Stopwatch(frame_stats,'encode'):
+                    image_writer.save(fpaths[fi],frame)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
+                
+    def write_frame_stack(self,fpath_npy,hooks=None,**kwargs):
+        '''Write every frame into a single .npy file holding an array of
+        shape (n_frames,height,width,4) and dtype uint8, copied straight from
+        the canvas buffer. It can be read back without loading it all with
+        np.load(fpath_npy,mmap_mode='r').
+        
+        Parameters
+        ----------
+        fpath_npy : str.
+            The path of the .npy file to write.
+            
+        hooks : list of callables, or None.
+            Called with the stats of each frame (see write_video).
+            
+        **kwargs
+            workers, chunksize and cache, as in write_video.
+        '''
+        with FrameStackWriter(fpath_npy,len(self.video_times)) as stack_writer:
+            for fi,(frame,frame_stats) in enumerate(self._iter_frames(**kwargs)):
+                with Stopwatch(frame_stats,'encode'):
+                    stack_writer.write(frame)
+                frame_stats.update(self._frame_info(fi))
+                call_hooks(hooks,frame_stats)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Writer which pipes raw RGBA frames straight to ffmpeg.
+"""
+
+import subprocess
+import threading
+import queue
+import numpy as np
+import matplotlib as mpl
+
+class FFMpegRawWriter:
+    '''
+    Write frames given as RGBA arrays to a video file by piping them to
+    ffmpeg's rawvideo input. The ffmpeg arguments mirror those used by
+    matplotlib's FFMpegWriter, so a video written from the same pixels is
+    identical to one written with matplotlib.
+
+    The size of the video is taken from the first frame written. When the
+    output pixel format is yuv420p (the default for h264), which needs even
+    dimensions, a frame with an odd width or height loses its last column or
+    row, as matplotlib's writers shrink the figure to even dimensions.
+    
+    By default, frames are copied into one of a small set of preallocated
+    buffers and handed to a background thread which writes them to ffmpeg's
+    stdin, so the next frame can be drawn while the current one is encoded.
+    The copy is needed since the canvas reuses its buffer for the next frame.
+    With queue_size=0, each frame is written straight from the array passed
+    without any copy, but drawing waits for the write to finish.
+
+    Parameters
+    ----------
+    fpath_video : str.
+        The path of the video file to write.
+
+    fps : float.
+        The frames per second of the video.
+
+    codec : str, or None.
+        The codec to use. Defaults to rcParams['animation.codec'].
+
+    bitrate : int, or None.
+        The bitrate in kbps. Defaults to rcParams['animation.bitrate'].
+
+    extra_args : list of str, or None.
+        Extra arguments passed to ffmpeg for the output. Defaults to
+        rcParams['animation.ffmpeg_args'].
+
+    metadata : dict, or None.
+        Metadata to include in the output file.
+        
+    queue_size : int.
+        The maximum number of frames waiting to be written. When the queue is
+        full, write blocks until ffmpeg catches up.
+    '''
+
+    def __init__(self,fpath_video,fps,codec=None,bitrate=None,extra_args=None,metadata=None,queue_size=4):
+        self.fpath_video = fpath_video
+        self.fps = fps
+        self.codec = mpl.rcParams['animation.codec'] if codec is None else codec
+        self.bitrate = mpl.rcParams['animation.bitrate'] if bitrate is None else bitrate
+        self.extra_args = list(mpl.rcParams['animation.ffmpeg_args']) if extra_args is None else list(extra_args)
+        self.metadata = {} if metadata is None else metadata
+        self.queue_size = queue_size
+        self.frame_size = None
+        self._proc = None
+        self._thread = None
+        self._error = None
+
+    def _args(self):
+        '''Assemble the command line to call ffmpeg with.
+        '''
+        args = [str(mpl.rcParams['animation.ffmpeg_path']),
+                '-f','rawvideo','-vcodec','rawvideo',
+                '-s','%dx%d' % self.frame_size,'-pix_fmt','rgba',
+                '-framerate',str(self.fps),'-loglevel','error','-i','pipe:',
+                '-vcodec',self.codec]
+        if self._default_yuv420p():
+            args += ['-pix_fmt','yuv420p']
+        if self.bitrate > 0:
+            args += ['-b','%dk' % self.bitrate]
+        for k,v in self.metadata.items():
+            args += ['-metadata','%s=%s' % (k,v)]
+        args += self.extra_args
+        return args + ['-y',self.fpath_video]
+
+    def _default_yuv420p(self):
+        '''Whether yuv420p is added as the output pixel format.
+        '''
+        return self.codec == 'h264' and '-pix_fmt' not in self.extra_args
+
+    def _needs_even_size(self):
+        '''Whether the output pixel format needs even frame dimensions.
+        '''
+        if '-pix_fmt' in self.extra_args[:-1]:
+            return self.extra_args[self.extra_args.index('-pix_fmt')+1] == 'yuv420p'
+        return self._default_yuv420p()
+
+    def _crop(self,frame):
+        '''Crop a frame to the size of the video.
+        '''
+        width,height = self.frame_size
+        if frame.shape[0] != height or frame.shape[1] != width:
+            return frame[:height,:width]
+        return frame
+
+    def _start(self,frame):
+        '''Launch the ffmpeg process and the writing thread once the frame
+        size is known.
+        '''
+        width,height = frame.shape[1],frame.shape[0]
+        if self._needs_even_size():
+            width,height = width//2*2,height//2*2
+        self.frame_size = (width,height)
+        self._proc = subprocess.Popen(self._args(),stdin=subprocess.PIPE,
+                                      stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+        if self.queue_size > 0:
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._free = queue.Queue()
+            for _ in range(self.queue_size+1):
+                self._free.put(np.empty((height,width,frame.shape[2]),dtype=np.uint8))
+            self._thread = threading.Thread(target=self._run,daemon=True)
+            self._thread.start()
+            
+    def _run(self):
+        '''Write queued frames to ffmpeg until None is received.
+        '''
+        while True:
+            buf = self._queue.get()
+            if buf is None:
+                return
+            try:
+                if self._error is None:
+                    self._proc.stdin.write(buf)
+            except Exception as e:
+                # keep draining the queue so write never blocks forever
+                self._error = e
+            self._free.put(buf)
+            
+    def _raise_error(self):
+        '''Re-raise an error hit writing to ffmpeg. When the pipe broke
+        because ffmpeg exited, raise its exit status and stderr instead.
+        '''
+        if self._error is None:
+            return
+        err,self._error = self._error,None
+        if isinstance(err,BrokenPipeError):
+            self._stop_thread()
+            _,stderr = self._proc.communicate()
+            returncode = self._proc.returncode
+            self._proc = None
+            if returncode:
+                raise subprocess.CalledProcessError(returncode,self._args(),stderr=stderr) from err
+        raise err
+
+    def write(self,frame):
+        '''Write one frame, given as an array of shape (height,width,4) and
+        dtype uint8.
+        '''
+        if self._proc is None:
+            self._start(frame)
+        frame = self._crop(frame)
+        if self._thread is None:
+            try:
+                self._proc.stdin.write(np.ascontiguousarray(frame))
+            except BrokenPipeError as e:
+                self._error = e
+                self._raise_error()
+            return
+        self._raise_error()
+        buf = self._free.get()
+        np.copyto(buf,frame)
+        self._queue.put(buf)
+        
+    def _stop_thread(self):
+        '''Let the writing thread finish the frames already queued.
+        '''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        '''Finish the video file and wait for ffmpeg to exit.
+        '''
+        if self._proc is None:
+            return
+        self._stop_thread()
+        if self._error is not None and not isinstance(self._error,BrokenPipeError):
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+        self._raise_error()
+        _,err = self._proc.communicate()
+        if self._proc.returncode:
+            raise subprocess.CalledProcessError(self._proc.returncode,self._args(),stderr=err)
+        self._proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is not None and self._proc is not None:
+            self._proc.kill()
+            self._stop_thread()
+            self._proc.wait()
+            self._proc = None
+        else:
+            self.close()